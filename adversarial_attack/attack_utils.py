@@ -1,18 +1,27 @@
 import validation.validate_image
 from adversarial_attack.attacks import AdversarialAttacks
+from adversarial_attack.instrumentation import ModelCounter
 import torch
 import time
 import json
-import art.config
-import numpy
 import os
+import hashlib
+import math
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from PIL import Image
-art.config.ART_NUMPY_DTYPE=numpy.float64
 
 device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 
 class Experiment_class():
-    def __init__(self, art_net, fb_net, net, xtest, ytest, alias, epsilon_l1, epsilon_l2, eps_iter, norm, max_iterations, batchsize, save_images, verbose):
+    def __init__(self, art_net, fb_net, net, xtest, ytest, alias, epsilon_l1, epsilon_l2, eps_iter, norm, max_iterations, batchsize, save_images, verbose, n_workers=1, model_config=None, journal_dir=None, dtype_policy=None, telemetry=False):
+        '''
+        n_workers: number of worker processes for attack_comparison, 1 runs everything in this process
+        model_config: keyword arguments of utils.get_model (dataset, modelname, norm, precision, channels_last), used by the workers to load the model
+        journal_dir: directory for the per-attack journals of finished samples, an interrupted run resumes from them
+        dtype_policy: DtypePolicy of the attacks, see AdversarialAttacks.init_attacker
+        telemetry: also time the model calls of the attacks, synchronises the GPU around every call
+        '''
         self.art_net = art_net
         self.fb_net=fb_net
         self.net = net
@@ -27,6 +36,26 @@ class Experiment_class():
         self.batchsize=batchsize
         self.save_images = save_images
         self.verbose=verbose
+        self.n_workers=n_workers
+        self.model_config=model_config
+        self.journal_dir=journal_dir
+        self.dtype_policy=dtype_policy
+        self.telemetry=telemetry
+
+    def journal_path(self, name):
+        '''
+        The file name contains a hash of the attack configuration and of the attacked samples, a run with other settings
+        or another sample selection (e.g. another --samplesize_accuracy split) never resumes from it.
+        '''
+        if self.journal_dir is None:
+            return None
+        os.makedirs(self.journal_dir, exist_ok=True)
+        digest = hashlib.sha1()
+        for tensor in (self.xtest, self.ytest):
+            digest.update(tensor.detach().cpu().contiguous().view(-1).view(torch.uint8).numpy().tobytes())
+        config = [self.epsilon_l1, self.epsilon_l2, self.eps_iter, self.norm, self.max_iterations, self.batchsize, repr(self.dtype_policy), digest.hexdigest()]
+        key = hashlib.sha1(json.dumps(config, default=str).encode()).hexdigest()[:16]
+        return os.path.join(self.journal_dir, f'{name}_{self.alias}_{len(self.xtest)}samples_{key}.jsonl')
 
     def hyperparameter_sweep(self, hyperparameter, range, attack_type):
         
@@ -43,7 +72,7 @@ class Experiment_class():
 
             results_dict[hyperparameter+str(value)] = {}
             print(f'\t\t-------------- Hyperparameter Sweep for Attack: {attack_type}: {hyperparameter} = {value} ----------------\n')
-            _, _, _, _, results_dict[hyperparameter+str(value)]["attack_success_rate_in_epsilon_l1"], results_dict[hyperparameter+str(value)]["attack_success_rate_in_epsilon_l2"], results_dict[hyperparameter+str(value)]["mean_adv_distance_l1"], results_dict[hyperparameter+str(value)]["mean_adv_distance_l2"], adv_images, results_dict[hyperparameter+str(value)]["average_sparsity"] = calculation(
+            _, _, _, _, results_dict[hyperparameter+str(value)]["attack_success_rate_in_epsilon_l1"], results_dict[hyperparameter+str(value)]["attack_success_rate_in_epsilon_l2"], results_dict[hyperparameter+str(value)]["mean_adv_distance_l1"], results_dict[hyperparameter+str(value)]["mean_adv_distance_l2"], adv_images, results_dict[hyperparameter+str(value)]["average_sparsity"], results_dict[hyperparameter+str(value)]["cost"] = calculation(
                                                                 art_net=self.art_net,
                                                                 fb_net=self.fb_net,
                                                                 net = self.net,
@@ -58,6 +87,9 @@ class Experiment_class():
                                                                 batchsize=self.batchsize,
                                                                 save_images=self.save_images,
                                                                 verbose=self.verbose,
+                                                                dtype_policy=self.dtype_policy,
+                                                                telemetry=self.telemetry,
+                                                                journal_path=self.journal_path(f'hyperparameter_sweep_{attack_type}_{hyperparameter}{value}'),
                                                                 **kwargs)
             
             print(hyperparameter+str(value), 'attack success rate in epsilon (L1 / L2): ',
@@ -93,10 +125,16 @@ class Experiment_class():
     def attack_comparison(self, attack_types):
         results_dict = {}
 
+        if self.n_workers > 1:
+            parallel_results = self.parallel_calculation(attack_types)
+
         for attack_type in attack_types:
             results_dict[attack_type] = {}
             print(f'\t\t-------------------------- Processing Attack: {attack_type} --------------------------\n')
-            results_dict[attack_type]["adversarial_distance_l1"], results_dict[attack_type]["adversarial_distance_l2"], results_dict[attack_type]["runtime"], results_dict[attack_type]["attack_success_rate"], results_dict[attack_type]["attack_success_rate_in_epsilon_l1"], results_dict[attack_type]["attack_success_rate_in_epsilon_l2"], results_dict[attack_type]["mean_adv_distance_l1"], results_dict[attack_type]["mean_adv_distance_l2"], adv_images, results_dict[attack_type]["average_sparsity"] = calculation(
+            if self.n_workers > 1:
+                results = parallel_results[attack_type]
+            else:
+                results = calculation(
                                                                 art_net=self.art_net,
                                                                 fb_net=self.fb_net,
                                                                 net = self.net,
@@ -110,9 +148,18 @@ class Experiment_class():
                                                                 attack_type=attack_type,
                                                                 batchsize=self.batchsize,
                                                                 save_images=self.save_images,
-                                                                verbose=self.verbose)
+                                                                verbose=self.verbose,
+                                                                dtype_policy=self.dtype_policy,
+                                                                telemetry=self.telemetry,
+                                                                journal_path=self.journal_path(f'attack_comparison_{attack_type}'))
+            results_dict[attack_type]["adversarial_distance_l1"], results_dict[attack_type]["adversarial_distance_l2"], results_dict[attack_type]["runtime"], results_dict[attack_type]["attack_success_rate"], results_dict[attack_type]["attack_success_rate_in_epsilon_l1"], results_dict[attack_type]["attack_success_rate_in_epsilon_l2"], results_dict[attack_type]["mean_adv_distance_l1"], results_dict[attack_type]["mean_adv_distance_l2"], adv_images, results_dict[attack_type]["average_sparsity"], results_dict[attack_type]["cost"] = results
             
             print(f'\nTotal runtime: {sum(results_dict[attack_type]["runtime"]): .4f} seconds\n')
+            total_cost = {key: sum(cost[key] or 0 for cost in results_dict[attack_type]["cost"]) for key in ModelCounter.keys}
+            timing = (f', {total_cost["forward_time"]:.4f} / {total_cost["backward_time"]:.4f} seconds'
+                      if self.telemetry else '')
+            print(f'Model cost (forward / backward): {total_cost["forward_images"]:.0f} / {total_cost["backward_images"]:.0f} images in '
+                  f'{total_cost["forward_calls"]:.0f} / {total_cost["backward_calls"]:.0f} calls{timing}\n')
             print('attack success rate in epsilon (L1 / L2): ',
                 round(results_dict[attack_type]["attack_success_rate_in_epsilon_l1"], 4),
                 ' / ',
@@ -140,6 +187,78 @@ class Experiment_class():
         
         return results_dict
 
+    def parallel_calculation(self, attack_types):
+        '''
+        Run calculation for all attacks on a pool of n_workers processes. The work is sharded into (attack, sample chunk)
+        items, every worker loads the model once from model_config and the per-sample records of the shards are merged
+        in sample order, so the results have the same layout as the ones of calculation.
+        '''
+        assert self.model_config is not None, "The workers need model_config to load the model"
+        assert torch.is_tensor(self.xtest), "Parallel execution needs the samples as tensors, not as a stream"
+        assert self.save_images <= len(self.xtest), "Number of images to be saved is larger than the number processed"
+
+        n_samples = len(self.xtest)
+        # chunks are a multiple of the batchsize, so the attacks see the same batches as in a sequential run
+        chunk_size = self.batchsize * max(1, math.ceil(n_samples / (self.n_workers * self.batchsize)))
+        work_items = [(attack_type, start, min(start + chunk_size, n_samples), self.journal_path(f'attack_comparison_{attack_type}'))
+                      for attack_type in attack_types
+                      for start in range(0, n_samples, chunk_size)]
+        settings = {'epsilon_l1': self.epsilon_l1,
+                    'epsilon_l2': self.epsilon_l2,
+                    'eps_iter': self.eps_iter,
+                    'norm': self.norm,
+                    'max_iterations': self.max_iterations,
+                    'batchsize': self.batchsize,
+                    'save_images': self.save_images,
+                    'verbose': self.verbose,
+                    'dtype_policy': self.dtype_policy,
+                    'telemetry': self.telemetry}
+        threads = max(1, (os.cpu_count() or 1) // self.n_workers)
+        for attack_type in attack_types:
+            journal_path = self.journal_path(f'attack_comparison_{attack_type}')
+            if journal_path is not None:
+                repair_journal(journal_path)
+
+        shards = {attack_type: [] for attack_type in attack_types}
+        # spawn instead of fork, forked processes cannot use CUDA
+        with ProcessPoolExecutor(max_workers=self.n_workers,
+                                 mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_init_worker,
+                                 initargs=(self.model_config, self.xtest.cpu(), self.ytest.cpu(), settings, threads)) as pool:
+            futures = {pool.submit(_run_shard, *item): item for item in work_items}
+            for future in as_completed(futures):
+                attack_type, start, stop, _ = futures[future]
+                shards[attack_type].append((start, future.result()))
+                print(f'{attack_type}: images {start} to {stop} done.')
+
+        parallel_results = {}
+        for attack_type in attack_types:
+            records, runtime_list, saved_images = [], [], []
+            for _, (shard_records, shard_runtimes, shard_images) in sorted(shards[attack_type], key=lambda shard: shard[0]):
+                records += shard_records
+                runtime_list += shard_runtimes
+                saved_images += shard_images
+            parallel_results[attack_type] = summarize(records, runtime_list, saved_images[:3 * self.save_images], n_samples, self.epsilon_l1, self.epsilon_l2)
+        return parallel_results
+
+
+# state of a worker process of Experiment_class.parallel_calculation
+_worker = {}
+
+def _init_worker(model_config, xtest, ytest, settings, threads):
+    import utils
+    torch.set_num_threads(threads)
+    net, art_net, fb_net, _ = utils.get_model(**model_config)
+    _worker.update(net=net, art_net=art_net, fb_net=fb_net, xtest=xtest, ytest=ytest, settings=settings)
+
+def _run_shard(attack_type, start, stop, journal_path):
+    return attack_samples(_worker['art_net'], _worker['fb_net'], _worker['net'],
+                          _worker['xtest'][start:stop], _worker['ytest'][start:stop],
+                          attack_type=attack_type,
+                          offset=start,
+                          journal_path=journal_path,
+                          **_worker['settings'])
+
 
 def attack_with_early_stopping(art_net, x, y, PGD_iterations, attacker, verbose=False):
     label_flipped = False
@@ -160,38 +279,81 @@ def attack_with_early_stopping(art_net, x, y, PGD_iterations, attacker, verbose=
             
     return adv_inputs
 
-def calculation(art_net, fb_net, net, xtest, ytest, epsilon_l1, epsilon_l2, eps_iter, norm, max_iterations, attack_type, batchsize = 1, learning_rate = None, beta = None, quantile = None, save_images: int = 0, verbose: bool = False):
-
-    sparsity_list,distance_list_l1, distance_list_l2, runtime_list = [], [], [], []
-    assert save_images <= len(xtest), "Number of images to be saved is larger than the number processed"
+def calculation(art_net, fb_net, net, xtest, ytest, epsilon_l1, epsilon_l2, eps_iter, norm, max_iterations, attack_type, batchsize = 1, learning_rate = None, beta = None, quantile = None, save_images: int = 0, verbose: bool = False, journal_path = None, dtype_policy = None, telemetry = False):
+
+    if torch.is_tensor(xtest):
+        assert save_images <= len(xtest), "Number of images to be saved is larger than the number processed"
+
+    if journal_path is not None:
+        repair_journal(journal_path)
+
+    records, runtime_list, saved_images = attack_samples(art_net, fb_net, net, xtest, ytest,
+                                                         epsilon_l1=epsilon_l1,
+                                                         epsilon_l2=epsilon_l2,
+                                                         eps_iter=eps_iter,
+                                                         norm=norm,
+                                                         max_iterations=max_iterations,
+                                                         attack_type=attack_type,
+                                                         batchsize=batchsize,
+                                                         learning_rate=learning_rate,
+                                                         beta=beta,
+                                                         quantile=quantile,
+                                                         save_images=save_images,
+                                                         verbose=verbose,
+                                                         journal_path=journal_path,
+                                                         dtype_policy=dtype_policy,
+                                                         telemetry=telemetry)
+
+    return summarize(records, runtime_list, saved_images, len(records), epsilon_l1, epsilon_l2)
+
+def attack_samples(art_net, fb_net, net, xtest, ytest, epsilon_l1, epsilon_l2, eps_iter, norm, max_iterations, attack_type, batchsize = 1, learning_rate = None, beta = None, quantile = None, save_images: int = 0, verbose: bool = False, offset: int = 0, journal_path = None, dtype_policy = None, telemetry = False):
+    '''
+    Attack all samples and return one record per sample, the runtime of every batch and the saved images.
+    xtest, ytest: tensors, or an iterable of (images, labels) batches and None, e.g. the stream of utils.subset
+    offset: index of the first sample of xtest in the full evaluation set, used for the record indices
+    journal_path: JSON lines file every finished batch is appended to. Batches already in the journal are not attacked
+                  again, their records are taken from the journal (images are only saved for newly attacked batches).
+    dtype_policy: DtypePolicy passed to AdversarialAttacks.init_attacker
+    Every record contains the model cost of the attack (ModelCounter.keys: forward / backward calls, images and time),
+    the counts of a batch are shared equally by its samples.
+    telemetry: also time the model calls, the times are None otherwise. Timing synchronises the GPU around every model
+               call and slows the attacks down.
+    '''
+
+    records, runtime_list = [], []
     saved_images = []
-
-    xtest = xtest.to(device)
-    ytest = ytest.to(device)
+    journal = read_journal(journal_path) if journal_path is not None else {}
     
     attacks = AdversarialAttacks(art_net=art_net,
                                  net = net,
                           epsilon=epsilon_l1,
                           eps_iter=eps_iter,
                           norm=norm,
-                          max_iterations=max_iterations)
+                          max_iterations=max_iterations,
+                          telemetry=telemetry)
     attacker = attacks.init_attacker(attack_type,
                           lr=learning_rate,
                           beta=beta,
                           quantile=quantile,
-                          verbose=verbose)
+                          verbose=verbose,
+                          dtype_policy=dtype_policy)
     #robust_predictions_l1 = 0
     #robust_predictions_l2 = 0
     #robust_predictions_en = 0
-    attack_successes_in_epsilon_l1 = 0
-    attack_successes_in_epsilon_l2 = 0
-    attack_successes_in_en = 0
-    attack_successes = 0
     #clean_correct = 0
     counter = 0
     
-    for i in range(0, len(xtest), batchsize):
-        x, y = xtest[i:min(i+batchsize, len(xtest))].clamp(0, 1), ytest[i:min(i+batchsize, len(xtest))]
+    for i, x, y in iterate_batches(xtest, ytest, batchsize):
+        x, y = x.to(device).clamp(0, 1), y.to(device)
+
+        if offset + i in journal:
+            journal_indices = [record['index'] for record in journal[offset + i]['records']]
+            if journal_indices != list(range(offset + i, offset + i + x.size(0))):
+                raise ValueError(f'Journal entry of the batch starting at {offset + i} has the records of samples {journal_indices}, '
+                                 f'the batch has {x.size(0)} samples. The journal "{journal_path}" belongs to another configuration.')
+            records += journal[offset + i]['records']
+            runtime_list.append(journal[offset + i]['runtime'])
+            continue
 
 #    for i, x in enumerate(xtest):
 
@@ -207,6 +369,7 @@ def calculation(art_net, fb_net, net, xtest, ytest, epsilon_l1, epsilon_l2, eps_
         #    continue        
 
         #clean_correct += 1
+        attacks.counter.reset()
         start_time = time.time()
 
         if attack_type == 'pgd_early_stopping':
@@ -243,6 +406,8 @@ def calculation(art_net, fb_net, net, xtest, ytest, epsilon_l1, epsilon_l2, eps_
         end_time = time.time()
         runtime = end_time - start_time
         runtime_list.append(runtime)
+        # the evaluation below is not part of the attack cost
+        cost = {key: None if value is None else value / x.size(0) for key, value in attacks.counter.snapshot().items()}
 
         # Adversarial accuracy calculation
         output_adversarial = art_net.predict(x_adversarial)
@@ -256,6 +421,7 @@ def calculation(art_net, fb_net, net, xtest, ytest, epsilon_l1, epsilon_l2, eps_
         # Iterate over the batch
         for j in range(x.size(0)):
             if int(predicted_adversarial[j].item()) == int(y[j].item()):
+                records.append({'index': offset + i + j, 'success': False, **cost})
                 if verbose:
                     print(f'Image {i + j}: No adversarial example found.')
             else:
@@ -265,41 +431,125 @@ def calculation(art_net, fb_net, net, xtest, ytest, epsilon_l1, epsilon_l2, eps_
                     inverted_delta = (delta[j] * 10).clamp(0, 1) #perturbations are magnified 10x for better visibility
                     saved_images.append(inverted_delta)
 
-                distance_list_l1.append(distance_l1[j].item())
-                distance_list_l2.append(distance_l2[j].item())
-
-                attack_successes_in_epsilon_l1 += (round(distance_l1[j].item(), 3) <= epsilon_l1)
-                attack_successes_in_epsilon_l2 += (round(distance_l2[j].item(), 3) <= epsilon_l2)
-                attack_successes_in_en += ((round(distance_l2[j].item(), 3) <= epsilon_l2) or (round(distance_l1[j].item(), 3) <= epsilon_l1))
-                attack_successes += 1
-
                 dim = torch.numel(delta[j])
                 sparsity = (dim - torch.count_nonzero(delta[j]).item()) / dim
-                sparsity_list.append(sparsity)
+                records.append({'index': offset + i + j,
+                                'success': True,
+                                'distance_l1': distance_l1[j].item(),
+                                'distance_l2': distance_l2[j].item(),
+                                'sparsity': sparsity,
+                                **cost})
 
                 if verbose:
                     print(f'Image {i + j}\t\tSuccesful attack with adversarial_distance (L1 / L2): {distance_l1[j]:.4f} / {distance_l2[j]:.5f}')
 
+        if journal_path is not None:
+            append_journal(journal_path, {'start': offset + i, 'runtime': runtime, 'records': records[-x.size(0):]})
+
         # Print progress summary after every 50 images
         if (i + x.size(0) - counter) >= 20:
             counter = i + x.size(0)
+            attack_successes, attack_successes_in_epsilon_l1, attack_successes_in_epsilon_l2, attack_successes_in_en = count_successes(records, epsilon_l1, epsilon_l2)
             print(
                 f'{i+x.size(0)} images done. Current Attack Success Rate (Overall / L1 / L2 / EN): '
                 f'{attack_successes * 100 / (i+x.size(0)):.2f}% / {attack_successes_in_epsilon_l1 * 100 / (i+x.size(0)):.2f}% / '
                 f'{attack_successes_in_epsilon_l2 * 100 / (i+x.size(0)):.2f}% / {attack_successes_in_en * 100 / (i+x.size(0)):.2f}%'
             )
 
-    #adversarial_accuracy_l1 = (robust_predictions_l1 / len(xtest)) * 100
-    #adversarial_accuracy_l2 = (robust_predictions_l2 / len(xtest)) * 100
-    #adversarial_accuracy_en = (robust_predictions_en / len(xtest)) * 100
-    attack_success_rate = (attack_successes / len(xtest)) * 100
-    attack_success_rate_in_epsilon_l1 = (attack_successes_in_epsilon_l1 / len(xtest)) * 100
-    attack_success_rate_in_epsilon_l2 = (attack_successes_in_epsilon_l2 / len(xtest)) * 100
-    attack_success_rate_in_epsilon_en = (attack_successes_in_en / len(xtest)) * 100
+    attacks.counter.detach()
+
+    return records, runtime_list, saved_images
+
+def iterate_batches(xtest, ytest, batchsize):
+    '''
+    Yields (index of the first sample, images, labels) for batches of batchsize samples. A stream of batches of any
+    size (ytest None) is regrouped on the fly.
+    '''
+    if torch.is_tensor(xtest):
+        for i in range(0, len(xtest), batchsize):
+            yield i, xtest[i:min(i+batchsize, len(xtest))], ytest[i:min(i+batchsize, len(xtest))]
+        return
+
+    i = 0
+    buffer_x, buffer_y = [], []
+    for x, y in xtest:
+        buffer_x.append(x)
+        buffer_y.append(y)
+        while sum(len(b) for b in buffer_x) >= batchsize:
+            x, y = torch.cat(buffer_x), torch.cat(buffer_y)
+            yield i, x[:batchsize], y[:batchsize]
+            i += batchsize
+            buffer_x, buffer_y = [x[batchsize:]], [y[batchsize:]]
+    if buffer_x and sum(len(b) for b in buffer_x) > 0:
+        yield i, torch.cat(buffer_x), torch.cat(buffer_y)
+
+def read_journal(journal_path):
+    '''
+    Finished batches of a journal, keyed by the index of their first sample. Lines that cannot be parsed are ignored.
+    '''
+    journal = {}
+    if not os.path.exists(journal_path):
+        return journal
+    with open(journal_path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            journal[entry['start']] = entry
+    return journal
+
+def repair_journal(journal_path):
+    '''
+    Cut off an incomplete last line (process killed while writing), so that new entries start on a line of their own.
+    Must not run while other processes append to the journal.
+    '''
+    if not os.path.exists(journal_path):
+        return
+    with open(journal_path, 'rb+') as f:
+        content = f.read()
+        if content and not content.endswith(b'\n'):
+            f.truncate(content.rfind(b'\n') + 1)
+
+def append_journal(journal_path, entry):
+    # one O_APPEND write per batch, so worker processes can share a journal, synced to survive a killed node
+    fd = os.open(journal_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, (json.dumps(entry) + '\n').encode())
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def count_successes(records, epsilon_l1, epsilon_l2):
+    '''
+    Number of successful attacks overall, within the L1 ball, within the L2 ball and within either of them.
+    '''
+    successful = [record for record in records if record['success']]
+    attack_successes_in_epsilon_l1 = sum(round(record['distance_l1'], 3) <= epsilon_l1 for record in successful)
+    attack_successes_in_epsilon_l2 = sum(round(record['distance_l2'], 3) <= epsilon_l2 for record in successful)
+    attack_successes_in_en = sum((round(record['distance_l2'], 3) <= epsilon_l2) or (round(record['distance_l1'], 3) <= epsilon_l1) for record in successful)
+    return len(successful), attack_successes_in_epsilon_l1, attack_successes_in_epsilon_l2, attack_successes_in_en
+
+def summarize(records, runtime_list, saved_images, n_samples, epsilon_l1, epsilon_l2):
+    '''
+    Aggregate the per-sample records (in sample order) into the results returned by calculation.
+    '''
+    successful = [record for record in records if record['success']]
+    distance_list_l1 = [record['distance_l1'] for record in successful]
+    distance_list_l2 = [record['distance_l2'] for record in successful]
+    sparsity_list = [record['sparsity'] for record in successful]
+    attack_successes, attack_successes_in_epsilon_l1, attack_successes_in_epsilon_l2, attack_successes_in_en = count_successes(records, epsilon_l1, epsilon_l2)
+
+    attack_success_rate = (attack_successes / n_samples) * 100
+    attack_success_rate_in_epsilon_l1 = (attack_successes_in_epsilon_l1 / n_samples) * 100
+    attack_success_rate_in_epsilon_l2 = (attack_successes_in_epsilon_l2 / n_samples) * 100
+    attack_success_rate_in_epsilon_en = (attack_successes_in_en / n_samples) * 100
     mean_adv_distance_l1 = (sum(distance_list_l1) / attack_successes) if attack_successes else 12
     mean_adv_distance_l2 = (sum(distance_list_l2) / attack_successes) if attack_successes else 5
     mean_sparsity=sum(sparsity_list)/attack_successes if attack_successes else 1.0
+    # model cost per sample, None for records of journals written before the cost was recorded
+    cost_list = [{'index': record['index'], **{key: record.get(key) for key in ModelCounter.keys}} for record in records]
 
     print(f'\naverage sparsity: {mean_sparsity*100:.2f}%\n')
 
-    return distance_list_l1, distance_list_l2, runtime_list, attack_success_rate, attack_success_rate_in_epsilon_l1, attack_success_rate_in_epsilon_l2, mean_adv_distance_l1, mean_adv_distance_l2, saved_images, mean_sparsity
\ No newline at end of file
+    return distance_list_l1, distance_list_l2, runtime_list, attack_success_rate, attack_success_rate_in_epsilon_l1, attack_success_rate_in_epsilon_l2, mean_adv_distance_l1, mean_adv_distance_l2, saved_images, mean_sparsity, cost_list
\ No newline at end of file
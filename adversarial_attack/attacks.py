@@ -15,17 +15,27 @@ from adversarial_attack.exp_attack_l1 import ExpAttackL1
 from autoattack import AutoAttack as original_AutoAttack
 from adversarial_attack.auto_attack.autoattack_custom import AutoAttack_Custom
 from adversarial_attack.exp_attack_l1_ada import ExpAttackL1Ada
+from adversarial_attack.instrumentation import ModelCounter
 device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 
 class AdversarialAttacks:
-  def __init__(self, art_net, net, epsilon, eps_iter, norm, max_iterations):
+  def __init__(self, art_net, net, epsilon, eps_iter, norm, max_iterations, telemetry=False):
     self.art_net = art_net
     self.epsilon = epsilon
     self.eps_iter = eps_iter
     self.norm = norm
     self.max_iterations = max_iterations
     self.net = net
-  def init_attacker(self, attack_type, lr=None, beta=None, quantile=None, verbose=False):
+    # art_net and the foolbox model wrap net, the counter sees the model calls of every attack
+    # telemetry also times the model calls, which synchronises the GPU around each of them
+    self.counter = ModelCounter(net, timing=telemetry)
+  def init_attacker(self, attack_type, lr=None, beta=None, quantile=None, verbose=False, dtype_policy=None):
+    '''
+    dtype_policy: DtypePolicy of the exp attacks, None uses their default (float32, float64 accumulation).
+                  ART and foolbox attacks run in the dtype of their inputs / art.config.ART_NUMPY_DTYPE.
+    The model of the returned attack is instrumented, self.counter counts its forward and backward passes.
+    '''
+    self.counter.attach()
 
     kwargs = {'verbose': verbose}
     if lr is not None:
@@ -34,6 +44,9 @@ class AdversarialAttacks:
         kwargs['beta'] = beta
     if quantile is not None:
         kwargs['quantile'] = quantile
+    exp_kwargs = dict(kwargs)
+    if dtype_policy is not None:
+        exp_kwargs['dtype_policy'] = dtype_policy
 
     if attack_type=='fast_gradient_method':
         return FastGradientMethod(self.art_net,
@@ -120,7 +133,6 @@ class AdversarialAttacks:
         #https://openaccess.thecvf.com/content_CVPR_2020/papers/Rahmati_GeoDA_A_Geometric_Framework_for_Black-Box_Adversarial_Attacks_CVPR_2020_paper.pdf
         fb.attacks.sparse_l1_descent_attack.SparseL1DescentAttack
         return GeoDA(self.art_net,
-                        batch_size=1,
                         norm=self.norm,
                         max_iter=4000,
                         lambda_param=0.6,
@@ -152,17 +164,17 @@ class AdversarialAttacks:
     elif attack_type=='exp_attack':
         return ExpAttack(self.art_net,
                       max_iter=self.max_iterations,
-                      **kwargs)
+                      **exp_kwargs)
     elif attack_type=='exp_attack_l1':
         return ExpAttackL1(self.art_net,
                       max_iter=self.max_iterations,
                       epsilon=self.epsilon,
-                      **kwargs)
+                      **exp_kwargs)
     elif attack_type=='exp_attack_l1_ada':
         return ExpAttackL1Ada(self.art_net,
                         max_iter=self.max_iterations,
                         epsilon=self.epsilon,
-                        **kwargs)
+                        **exp_kwargs)
     elif attack_type=='custom_apgd':
         attack= AutoAttack_Custom(self.net, 
                                    norm='L1', 
@@ -5,10 +5,61 @@ import torch.nn.functional as F
 import math
 import random
 
-from autoattack.other_utils import L0_norm, L1_norm, L2_norm
+from autoattack.other_utils import L0_norm
 from autoattack.checks import check_zero_gradients
 from autoattack.autopgd_base import L1_projection
 
+from adversarial_attack.compiled_step import CompiledStep
+from adversarial_attack.restart_utils import replicate, first_replica
+
+
+def _keepdim(z, x):
+    return z.view([-1] + [1] * (x.dim() - 1))
+
+
+def linf_step(x, x_adv, grad, grad2, step_size, eps: float, a: float):
+    x_adv_1 = x_adv + step_size * torch.sign(grad)
+    x_adv_1 = torch.clamp(torch.min(torch.max(x_adv_1,
+        x - eps), x + eps), 0.0, 1.0)
+    x_adv_1 = torch.clamp(torch.min(torch.max(
+        x_adv + (x_adv_1 - x_adv) * a + grad2 * (1 - a),
+        x - eps), x + eps), 0.0, 1.0)
+    return x_adv_1
+
+
+def _l2_norm(x):
+    return _keepdim((x ** 2).view(x.shape[0], -1).sum(-1).sqrt(), x)
+
+
+def _l2_project(x, x_adv_1, eps: float):
+    delta = x_adv_1 - x
+    norm = _l2_norm(delta)
+    return torch.clamp(x + delta / (norm + 1e-12) * torch.min(
+        eps * torch.ones_like(x), norm), 0.0, 1.0)
+
+
+def l2_step(x, x_adv, grad, grad2, step_size, eps: float, a: float):
+    x_adv_1 = x_adv + step_size * grad / (_l2_norm(grad) + 1e-12)
+    x_adv_1 = _l2_project(x, x_adv_1, eps)
+    x_adv_1 = x_adv + (x_adv_1 - x_adv) * a + grad2 * (1 - a)
+    return _l2_project(x, x_adv_1, eps)
+
+
+def l1_sparse_step(x_adv, grad, step_size, topk):
+    """
+    Step along the sign of the top-k gradient entries of every sample, normalized to unit L1 norm.
+    The projection onto the L1 ball is done by the caller.
+    """
+    n_fts = grad[0].numel()
+    u = torch.arange(grad.shape[0], device=grad.device)
+    grad_topk = grad.abs().view(grad.shape[0], -1).sort(-1)[0]
+    topk_curr = torch.clamp((1. - topk) * n_fts, min=0, max=n_fts - 1).long()
+    grad_topk = _keepdim(grad_topk[u, topk_curr], grad)
+    sparsegrad = grad * (grad.abs() >= grad_topk).float()
+    return x_adv + step_size * sparsegrad.sign() / (
+        _keepdim(sparsegrad.sign().abs().view(grad.shape[0], -1).sum(-1), grad) + 1e-10)
+
+
 class APGDAttackCustom():
     """
     AutoPGD
@@ -23,6 +74,12 @@ class APGDAttackCustom():
     :param loss:          loss to optimize ('ce', 'dlr' supported)
     :param eot_iter:      iterations for Expectation over Trasformation
     :param rho:           parameter for decreasing the step size
+    :param compile_step:  compile the update after every gradient with torch.compile
+                          (TorchScript as fallback), the L1 projection stays eager
+    :param parallel_restarts: number of restarts run concurrently, the images still
+                          to fool are replicated along the batch axis. The L1 attack
+                          starts at the clean images, the replicas after the first
+                          start at a random point of the L1 ball instead
     """
 
     def __init__(
@@ -41,7 +98,9 @@ class APGDAttackCustom():
             device=None,
             use_largereps=False,
             is_tf_model=False,
-            logger=None):
+            logger=None,
+            compile_step=False,
+            parallel_restarts=1):
         """
         AutoPGD implementation in PyTorch
         """
@@ -51,6 +110,7 @@ class APGDAttackCustom():
         self.eps = eps
         self.norm = norm
         self.n_restarts = n_restarts
+        self.parallel_restarts = parallel_restarts
         self.seed = seed
         self.loss = loss
         self.eot_iter = eot_iter
@@ -77,6 +137,12 @@ class APGDAttackCustom():
         self.n_iter_min = max(int(0.06 * self.n_iter), 1)
         self.size_decr = max(int(0.03 * self.n_iter), 1)
 
+        ### update after every gradient, compiled once per shape and dtype if requested
+        self.compile_step = compile_step
+        self.step_linf = CompiledStep(linf_step) if compile_step else linf_step
+        self.step_l2 = CompiledStep(l2_step) if compile_step else l2_step
+        self.step_l1 = CompiledStep(l1_sparse_step) if compile_step else l1_sparse_step
+
     def init_hyperparam(self, x):
 
         if self.device is None:
@@ -86,12 +152,18 @@ class APGDAttackCustom():
         if self.seed is None:
             self.seed = time.time()
 
-    def check_oscillation(self, x, j, k, y5, k3=0.75):
-        t = torch.zeros(x.shape[1]).to(self.device)
-        for counter5 in range(k):
-          t += (x[j - counter5] > x[j - counter5 - 1]).float()
+    def check_oscillation(self, x, j, k, k3=0.75):
+        """
+        :param x:   ring buffer of the losses, the loss of iteration i is stored in row i % len(x)
+        :param j:   current iteration
+        :param k:   number of steps to look back, at most len(x) - 1
+        :return:    1. for the samples whose loss increased in at most k * k3 of the last k steps
+        """
+        ind = (j - torch.arange(k + 1, device=x.device)) % x.shape[0]
+        window = x[ind]
+        t = (window[:-1] > window[1:]).float().sum(0)
 
-        return (t <= k * k3 * torch.ones_like(t)).float()
+        return (t <= k * k3).float()
 
     def check_shape(self, x):
         return x if len(x.shape) > 0 else x.unsqueeze(0)
@@ -121,7 +193,11 @@ class APGDAttackCustom():
 
     #
     
-    def attack_single_run(self, x, y, x_init=None):
+    def attack_single_run(self, x, y, x_init=None, n_rep=1):
+        """
+        :param n_rep:       number of replicas the batch consists of, for L1 the
+                            replicas after the first start at a random point
+        """
         if len(x.shape) < self.ndims:
             x = x.unsqueeze(0)
             y = y.unsqueeze(0)
@@ -136,6 +212,11 @@ class APGDAttackCustom():
                 ).detach() * self.normalize(t)
         elif self.norm == 'L1':
             t = torch.zeros(x.shape).to(self.device).detach()
+            if n_rep > 1:
+                # the zero start is deterministic, the other replicas would repeat the first one
+                n_first = x.shape[0] // n_rep
+                t[n_first:] = torch.randn_like(x[n_first:])
+                t[n_first:] += L1_projection(x[n_first:], t[n_first:], self.eps)
             x_adv = x + t 
             
         
@@ -152,11 +233,9 @@ class APGDAttackCustom():
         x_adv = x_adv.clamp(0., 1.)
         x_best = x_adv.clone()
         x_best_adv = x_adv.clone()
-        loss_steps = torch.zeros([self.n_iter, x.shape[0]]
-            ).to(self.device)
-        loss_best_steps = torch.zeros([self.n_iter + 1, x.shape[0]]
+        # the oscillation check looks back at most n_iter_2 steps, older losses are overwritten
+        loss_steps = torch.zeros([min(self.n_iter_2 + 1, self.n_iter), x.shape[0]]
             ).to(self.device)
-        acc_steps = torch.zeros_like(loss_best_steps)
 
         if not self.is_tf_model:
             if self.loss == 'ce':
@@ -209,7 +288,6 @@ class APGDAttackCustom():
             check_zero_gradients(grad, logger=self.logger)
         
         acc = logits.detach().max(1)[1] == y
-        acc_steps[0] = acc + 0
         loss_best = loss_indiv.detach().clone()
 
         alpha = 2. if self.norm in ['Linf', 'L2'] else 1. if self.norm in ['L1'] else 2e-2
@@ -225,6 +303,11 @@ class APGDAttackCustom():
                 topk = .2 * torch.ones([x.shape[0]], device=self.device)
                 #topk = 1.0 * torch.ones([x.shape[0]], device=self.device)
                 sp_old =  n_fts * torch.ones_like(topk)
+                if n_rep > 1:
+                    # random starts are handled like a custom init
+                    n_first = x.shape[0] // n_rep
+                    topk[n_first:] = L0_norm(x_adv[n_first:] - x[n_first:]) / n_fts / 1.5
+                    sp_old[n_first:] = L0_norm(x_adv[n_first:] - x[n_first:])
             else:
                 topk = L0_norm(x_adv - x) / n_fts / 1.5
                 sp_old = L0_norm(x_adv - x)
@@ -249,30 +332,13 @@ class APGDAttackCustom():
                 a = 0.75 if i > 0 else 1.0
 
                 if self.norm == 'Linf':
-                    x_adv_1 = x_adv + step_size * torch.sign(grad)
-                    x_adv_1 = torch.clamp(torch.min(torch.max(x_adv_1,
-                        x - self.eps), x + self.eps), 0.0, 1.0)
-                    x_adv_1 = torch.clamp(torch.min(torch.max(
-                        x_adv + (x_adv_1 - x_adv) * a + grad2 * (1 - a),
-                        x - self.eps), x + self.eps), 0.0, 1.0)
+                    x_adv_1 = self.step_linf(x, x_adv, grad, grad2, step_size, float(self.eps), a)
 
                 elif self.norm == 'L2':
-                    x_adv_1 = x_adv + step_size * self.normalize(grad)
-                    x_adv_1 = torch.clamp(x + self.normalize(x_adv_1 - x
-                        ) * torch.min(self.eps * torch.ones_like(x).detach(),
-                        L2_norm(x_adv_1 - x, keepdim=True)), 0.0, 1.0)
-                    x_adv_1 = x_adv + (x_adv_1 - x_adv) * a + grad2 * (1 - a)
-                    x_adv_1 = torch.clamp(x + self.normalize(x_adv_1 - x
-                        ) * torch.min(self.eps * torch.ones_like(x).detach(),
-                        L2_norm(x_adv_1 - x, keepdim=True)), 0.0, 1.0)
+                    x_adv_1 = self.step_l2(x, x_adv, grad, grad2, step_size, float(self.eps), a)
 
                 elif self.norm == 'L1':
-                    grad_topk = grad.abs().view(x.shape[0], -1).sort(-1)[0]
-                    topk_curr = torch.clamp((1. - topk) * n_fts, min=0, max=n_fts - 1).long()
-                    grad_topk = grad_topk[u, topk_curr].view(-1, *[1]*(len(x.shape) - 1))
-                    sparsegrad = grad * (grad.abs() >= grad_topk).float()
-                    x_adv_1 = x_adv + step_size * sparsegrad.sign() / (
-                        L1_norm(sparsegrad.sign(), keepdim=True) + 1e-10)
+                    x_adv_1 = self.step_l1(x_adv, grad, step_size, topk)
                     
                     delta_u = x_adv_1 - x
                     delta_p = L1_projection(x, delta_u, self.eps)
@@ -303,7 +369,6 @@ class APGDAttackCustom():
 
             pred = logits.detach().max(1)[1] == y
             acc = torch.min(acc, pred)
-            acc_steps[i + 1] = acc + 0
             ind_pred = (pred == 0).nonzero().squeeze()
             x_best_adv[ind_pred] = x_adv[ind_pred] + 0.
             if self.verbose:
@@ -316,19 +381,18 @@ class APGDAttackCustom():
             ### check step size
             with torch.no_grad():
               y1 = loss_indiv.detach().clone()
-              loss_steps[i] = y1 + 0
+              loss_steps[i % loss_steps.shape[0]] = y1 + 0
               ind = (y1 > loss_best).nonzero().squeeze()
               x_best[ind] = x_adv[ind].clone()
               grad_best[ind] = grad[ind].clone()
               loss_best[ind] = y1[ind] + 0
-              loss_best_steps[i + 1] = loss_best + 0
 
               counter3 += 1
 
               if counter3 == k:
                   if self.norm in ['Linf', 'L2']:
                       fl_oscillation = self.check_oscillation(loss_steps, i, k,
-                          loss_best, k3=self.thr_decr)
+                          k3=self.thr_decr)
                       fl_reduce_no_impr = (1. - reduced_last_check) * (
                           loss_best_last_check >= loss_best).float()
                       fl_oscillation = torch.max(fl_oscillation,
@@ -420,27 +484,34 @@ class APGDAttackCustom():
             torch.random.manual_seed(self.seed)
             torch.cuda.random.manual_seed(self.seed)
 
-            for counter in range(self.n_restarts):
+            n_parallel = max(self.parallel_restarts, 1)
+            for counter in range(0, self.n_restarts, n_parallel):
                 ind_to_fool = acc.nonzero().squeeze()
                 if len(ind_to_fool.shape) == 0:
                     ind_to_fool = ind_to_fool.unsqueeze(0)
                 if ind_to_fool.numel() != 0:
-                    x_to_fool = x[ind_to_fool].clone()
-                    y_to_fool = y[ind_to_fool].clone()
+                    # replicas of the restarts run together, every replica draws its own random starting point
+                    n_rep = min(n_parallel, self.n_restarts - counter)
+                    x_to_fool = replicate(x[ind_to_fool], n_rep)
+                    y_to_fool = replicate(y[ind_to_fool], n_rep)
                     
                     
                     if not self.use_largereps:
-                        res_curr = self.attack_single_run(x_to_fool, y_to_fool)
+                        res_curr = self.attack_single_run(x_to_fool, y_to_fool, n_rep=n_rep)
                     else:
-                        res_curr = self.decr_eps_pgd(x_to_fool, y_to_fool, epss, iters)
+                        res_curr = self.decr_eps_pgd(x_to_fool, y_to_fool, epss, iters, n_rep=n_rep)
                     best_curr, acc_curr, loss_curr, adv_curr = res_curr
+                    if n_rep > 1:
+                        # first successful replica per image, the one sequential restarts would have returned
+                        ind_rep = first_replica(acc_curr == 0, n_rep)
+                        acc_curr, adv_curr = acc_curr[ind_rep], adv_curr[ind_rep]
                     ind_curr = (acc_curr == 0).nonzero().squeeze()
 
                     acc[ind_to_fool[ind_curr]] = 0
                     adv[ind_to_fool[ind_curr]] = adv_curr[ind_curr].clone()
                     if self.verbose:
                         print('restart {} - robust accuracy: {:.2%}'.format(
-                            counter, acc.float().mean()),
+                            counter + n_rep - 1, acc.float().mean()),
                             '- cum. time: {:.1f} s'.format(
                             time.time() - startt))
 
@@ -450,19 +521,27 @@ class APGDAttackCustom():
             adv_best = x.detach().clone()
             loss_best = torch.ones([x.shape[0]]).to(
                 self.device) * (-float('inf'))
-            for counter in range(self.n_restarts):
-                best_curr, _, loss_curr, _ = self.attack_single_run(x, y)
+            n_parallel = max(self.parallel_restarts, 1)
+            for counter in range(0, self.n_restarts, n_parallel):
+                n_rep = min(n_parallel, self.n_restarts - counter)
+                best_curr, _, loss_curr, _ = self.attack_single_run(replicate(x, n_rep), replicate(y, n_rep),
+                                                                    n_rep=n_rep)
+                if n_rep > 1:
+                    # highest loss over the replicas, the first one on ties
+                    loss_curr = loss_curr.view(n_rep, -1)
+                    ind_rep = first_replica(loss_curr == loss_curr.max(0)[0], n_rep)
+                    best_curr, loss_curr = best_curr[ind_rep], loss_curr.view(-1)[ind_rep]
                 ind_curr = (loss_curr > loss_best).nonzero().squeeze()
                 adv_best[ind_curr] = best_curr[ind_curr] + 0.
                 loss_best[ind_curr] = loss_curr[ind_curr] + 0.
 
                 if self.verbose:
                     print('restart {} - loss: {:.5f}'.format(
-                        counter, loss_best.sum()))
+                        counter + n_rep - 1, loss_best.sum()))
 
             return adv_best
 
-    def decr_eps_pgd(self, x, y, epss, iters, use_rs=True):
+    def decr_eps_pgd(self, x, y, epss, iters, use_rs=True, n_rep=1):
         assert len(epss) == len(iters)
         assert self.norm in ['L1']
         self.use_rs = False
@@ -482,6 +561,6 @@ class APGDAttackCustom():
             #
             if not x_init is None:
                 x_init += L1_projection(x, x_init - x, 1. * eps)
-            x_init, acc, loss, x_adv = self.attack_single_run(x, y, x_init=x_init)
+            x_init, acc, loss, x_adv = self.attack_single_run(x, y, x_init=x_init, n_rep=n_rep)
 
         return (x_init, acc, loss, x_adv)
\ No newline at end of file
@@ -0,0 +1,103 @@
+"""
+Compiled step functions for the iterative attacks. The update an attack applies after every gradient is a chain of
+small element-wise kernels; compiled into one graph it is dispatched from Python only once per iteration.
+"""
+from __future__ import annotations
+
+import logging
+import warnings
+
+logger = logging.getLogger(__name__)
+
+
+class CompiledStep:
+    """
+    Callable wrapper of a pure step function (tensors in, tensors out, no in-place updates of the inputs). The function
+    is compiled with `torch.compile`, with TorchScript as fallback and eager execution as last resort. Compilation
+    happens on the first call for every combination of argument shapes except the batch dimension, dtypes and devices
+    (and values of non-tensor arguments); the first call doubles as warm-up and the compiled function is cached for all
+    following calls.
+
+    The batch dimension (dim 0) of all tensor arguments is compiled as dynamic: with per-sample early stopping the
+    batch shrinks over time, a static graph per batch size would run into the recompile limit of dynamo.
+    """
+
+    backends = ("compile", "script", "eager")
+
+    def __init__(self, fn, backend: str = "compile") -> None:
+        """
+        :param fn: Step function. It has to be scriptable for the TorchScript fallback (type annotations for
+               non-tensor arguments, no closures).
+        :param backend: First backend to try, `compile`, `script` or `eager`. Later backends are the fallbacks.
+        """
+        if backend not in self.backends:
+            raise ValueError(f"The backend has to be one of {self.backends}.")
+        self.fn = fn
+        self.backend = backend
+        self._scripted = None
+        self._cache: dict = {}
+
+    def __call__(self, *args):
+        key = self._key(args)
+        step = self._cache.get(key)
+        if step is not None:
+            return step(*args)
+        step, out = self._build(args)
+        self._cache[key] = step
+        return out
+
+    @property
+    def compiled_backends(self) -> list:
+        """
+        Backends that ended up being used, one entry per cached (shape, dtype) key.
+        """
+        return [getattr(step, "_backend", "eager") for step in self._cache.values()]
+
+    @staticmethod
+    def _key(args) -> tuple:
+        import torch
+
+        return tuple(
+            (tuple(a.shape[1:]), a.dtype, a.device) if isinstance(a, torch.Tensor) else (type(a), a) for a in args
+        )
+
+    def _build(self, args) -> tuple:
+        for backend in self.backends[self.backends.index(self.backend):]:
+            try:
+                step = self._compile(backend)
+                # the first call compiles, a failure falls back to the next backend
+                out = step(*args)
+            except Exception as error:  # pylint: disable=broad-except
+                if backend == "eager":
+                    raise
+                warnings.warn(f"Compiling {self.fn.__name__} with {backend} failed, falling back: {error}")
+                continue
+            logger.debug("Compiled %s with %s", self.fn.__name__, backend)
+            return step, out
+        raise RuntimeError("No backend left.")  # pragma: no cover
+
+    def _compile(self, backend: str):
+        import torch
+
+        if backend == "compile":
+            # one compiled function per key, static in all dimensions but the batch dimension
+            compiled_fn = torch.compile(self.fn, dynamic=False)
+
+            def compiled(*args):
+                for a in args:
+                    if isinstance(a, torch.Tensor) and a.dim() > 0:
+                        torch._dynamo.maybe_mark_dynamic(a, 0)
+                return compiled_fn(*args)
+
+        elif backend == "script":
+            if self._scripted is None:
+                self._scripted = torch.jit.script(self.fn)
+            compiled = self._scripted
+        else:
+            compiled = self.fn
+
+        def step(*args):
+            return compiled(*args)
+
+        step._backend = backend
+        return step
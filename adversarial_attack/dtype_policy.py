@@ -0,0 +1,53 @@
+"""
+Floating point types an attack runs in, replaces the global `art.config.ART_NUMPY_DTYPE` override.
+"""
+from __future__ import annotations
+
+import numpy as np
+
+class DtypePolicy:
+    """
+    Per-attack dtype policy.
+
+    - `compute`: iterates, gradients and the inputs of the model.
+    - `accumulation`: precision-sensitive reductions an attack opts into locally, e.g. the log-sum-exp of the L1
+      projection of `ExpAttackL1`. Everything else stays in the compute dtype.
+    - `storage`: the adversarial examples returned by the attack.
+
+    The default runs in float32 and accumulates in float64. `DtypePolicy("float64", "float64", "float64")` reproduces
+    the former double precision runs.
+    """
+
+    dtypes = ("float16", "float32", "float64")
+
+    def __init__(self, compute: str = "float32", accumulation: str = "float64", storage: str = "float32") -> None:
+        """
+        :param compute: Dtype of the iterates and model inputs.
+        :param accumulation: Dtype of the precision-sensitive reductions.
+        :param storage: Dtype of the returned adversarial examples.
+        """
+        for name, dtype in (("compute", compute), ("accumulation", accumulation), ("storage", storage)):
+            if dtype not in self.dtypes:
+                raise ValueError(f"The {name} dtype has to be one of {self.dtypes}.")
+        self.compute = compute
+        self.accumulation = accumulation
+        self.storage = storage
+
+    def __repr__(self) -> str:
+        return f"DtypePolicy(compute={self.compute!r}, accumulation={self.accumulation!r}, storage={self.storage!r})"
+
+    def numpy(self, kind: str) -> np.dtype:
+        """
+        :param kind: `compute`, `accumulation` or `storage`.
+        :return: The numpy dtype of `kind`.
+        """
+        return np.dtype(getattr(self, kind))
+
+    def torch(self, kind: str):
+        """
+        :param kind: `compute`, `accumulation` or `storage`.
+        :return: The torch dtype of `kind`.
+        """
+        import torch
+
+        return getattr(torch, getattr(self, kind))
@@ -6,8 +6,6 @@ from art.attacks.evasion import ElasticNet
 
 import logging
 from typing import TYPE_CHECKING
-from cmath import inf
-from scipy.special import lambertw
 import numpy as np
 import six
 from tqdm.auto import trange
@@ -21,6 +19,8 @@ from art.utils import (
     get_labels_np_array,
     check_and_transform_label_format,
 )
+from adversarial_attack.dtype_policy import DtypePolicy
+from adversarial_attack.exp_attack_utils import EarlyStopping, compact, sparsify_topk, update_best, wright_omega
 
 if TYPE_CHECKING:
     from art.utils import CLASSIFIER_CLASS_LOSS_GRADIENTS_TYPE
@@ -40,6 +40,10 @@ class ExpAttack(ElasticNet):
         "batch_size",
         "decision_rule",
         "verbose",
+        "patience",
+        "target_distance",
+        "warm_start_tolerance",
+        "parallel_constants",
     ]
 
     _estimator_requirements = (BaseEstimator, ClassGradientsMixin)
@@ -58,7 +62,12 @@ class ExpAttack(ElasticNet):
         decision_rule: str = "EN",
         verbose: bool = True,
         quantile:float =0.9,
-        smooth:float=False
+        smooth:float=False,
+        patience: int | None = None,
+        target_distance: float | None = None,
+        warm_start_tolerance: float = 0.0,
+        parallel_constants: int = 1,
+        dtype_policy: DtypePolicy | None = None
     ) -> None:
         """
         Create an ElasticNet attack instance.
@@ -78,6 +87,16 @@ class ExpAttack(ElasticNet):
         :param batch_size: Internal size of batches on which adversarial samples are generated.
         :param decision_rule: Decision rule. 'EN' means Elastic Net rule, 'L1' means L1 rule, 'L2' means L2 rule.
         :param verbose: Show progress bars.
+        :param patience: Stop optimising a sample after this many iterations without a smaller distance.
+        :param target_distance: Stop optimising a sample once its distance (decision rule) is below this value.
+        :param warm_start_tolerance: Reuse the sparsification threshold of the previous iteration as long as the
+               number of kept gradient entries deviates by at most this fraction of the input size. `0.0` disables it.
+        :param parallel_constants: Number of constants `c` evaluated at once by tiling the batch. Every round narrows the
+               bracket of each sample by a factor `parallel_constants + 1`, so the `binary_search_steps` sequential
+               steps shrink to `ceil(binary_search_steps / log2(parallel_constants + 1))` rounds. `1` runs the
+               sequential binary search.
+        :param dtype_policy: Dtypes of the iterates (compute) and of the returned examples (storage). Defaults to
+               `DtypePolicy()`.
         """
         EvasionAttack.__init__(self,estimator=classifier)
         self.confidence = confidence
@@ -93,6 +112,12 @@ class ExpAttack(ElasticNet):
         self.eta=0.0
         self.smooth=smooth
         self.quantile=quantile
+        self._stopping=EarlyStopping(patience=patience, target_distance=target_distance)
+        self.warm_start_tolerance=warm_start_tolerance
+        if not isinstance(parallel_constants, int) or parallel_constants < 1:
+            raise ValueError("The number of parallel constants has to be a positive integer.")
+        self.parallel_constants=parallel_constants
+        self.dtype_policy=dtype_policy if dtype_policy is not None else DtypePolicy()
         self._check_params()
 
     def generate(self, x: np.ndarray, y: np.ndarray | None = None, **kwargs) -> np.ndarray:
@@ -107,7 +132,7 @@ class ExpAttack(ElasticNet):
         """
         if y is not None:
             y = check_and_transform_label_format(y, nb_classes=self.estimator.nb_classes)
-        x_adv = x.astype(ART_NUMPY_DTYPE)
+        x_adv = x.astype(self.dtype_policy.numpy("compute"))
 
         # Assert that, if attack is targeted, y is provided:
         if self.targeted and y is None:  # pragma: no cover
@@ -128,7 +153,10 @@ class ExpAttack(ElasticNet):
             batch_index_1, batch_index_2 = batch_id * self.batch_size, (batch_id + 1) * self.batch_size
             x_batch = x_adv[batch_index_1:batch_index_2]
             y_batch = y[batch_index_1:batch_index_2]
-            x_adv[batch_index_1:batch_index_2] = self._generate_batch(x_batch, y_batch)
+            if self.parallel_constants > 1:
+                x_adv[batch_index_1:batch_index_2] = self._generate_batch_parallel(x_batch, y_batch)
+            else:
+                x_adv[batch_index_1:batch_index_2] = self._generate_batch(x_batch, y_batch)
 
         # Apply clip
         if self.estimator.clip_values is not None:
@@ -137,10 +165,10 @@ class ExpAttack(ElasticNet):
         # Compute success rate of the EAD attack
         logger.info(
             "Success rate of EAD attack: %.2f%%",
-            100 * compute_success(self.estimator, x, y, x_adv, self.targeted, batch_size=self.batch_size),
+            100 * compute_success(self.estimator, x, y, x_adv.astype(ART_NUMPY_DTYPE), self.targeted, batch_size=self.batch_size),
         )
 
-        return x_adv
+        return x_adv.astype(self.dtype_policy.numpy("storage"))
 
 
     def _generate_batch(self, x_batch: np.ndarray, y_batch: np.ndarray) -> np.ndarray:
@@ -184,6 +212,63 @@ class ExpAttack(ElasticNet):
             )
 
         return o_best_attack
+
+    def _generate_batch_parallel(self, x_batch: np.ndarray, y_batch: np.ndarray) -> np.ndarray:
+        """
+        Run the attack on a batch of images and labels, evaluating `parallel_constants` constants per sample at once.
+
+        :param x_batch: A batch of original examples.
+        :param y_batch: A batch of targets (0-1 hot).
+        :return: A batch of adversarial examples.
+        """
+        n = x_batch.shape[0]
+        k = self.parallel_constants
+        rounds = int(np.ceil(self.binary_search_steps / np.log2(k + 1)))
+        steps = np.arange(1, k + 1)
+
+        # Initialize the brackets, `c_lower_bound` is the largest failed and `c_upper_bound` the smallest successful c
+        c_lower_bound = np.zeros(n)
+        c_upper_bound = 10e10 * np.ones(n)
+
+        # Initialize the best distortions and best attacks globally
+        o_best_dist = np.inf * np.ones(n)
+        o_best_attack = x_batch.copy()
+
+        # the tiles are ordered constant-major, row `j * n + i` runs sample `i` with its `j`-th constant
+        x_tiled = np.tile(x_batch, (k,) + (1,) * (x_batch.ndim - 1))
+        y_tiled = np.tile(y_batch, (k, 1))
+
+        for rnd in range(rounds):
+            if rnd == 0:
+                # same constants as the first `k` failures of the sequential search
+                c_current = self.initial_const * 10.0 ** (steps[:, None] - 1) * np.ones(n)
+            else:
+                # equidistant interior points of the bracket, or keep growing by 10 while no c succeeded
+                c_current = np.where(
+                    c_upper_bound < 1e9,
+                    c_lower_bound + (c_upper_bound - c_lower_bound) * steps[:, None] / (k + 1),
+                    c_lower_bound * 10.0 ** steps[:, None],
+                )
+            logger.debug("Parallel search round %i out of %i (c_mean==%f)", rnd, rounds, np.mean(c_current))
+
+            best_dist, _, best_attack = self._generate_bss(x_tiled, y_tiled, c_current.reshape(-1))
+            best_dist = best_dist.reshape(k, n)
+            best_attack = best_attack.reshape((k,) + x_batch.shape)
+
+            # Update best results so far
+            best_tile = np.argmin(best_dist, axis=0)
+            tile_dist = best_dist[best_tile, np.arange(n)]
+            improved = tile_dist < o_best_dist
+            o_best_attack[improved] = best_attack[best_tile, np.arange(n)][improved]
+            o_best_dist[improved] = tile_dist[improved]
+
+            # Narrow the brackets, a constant succeeded if any of its iterates was adversarial
+            success = np.isfinite(best_dist)
+            c_upper_bound = np.minimum(c_upper_bound, np.min(np.where(success, c_current, np.inf), axis=0))
+            failed = ~success & (c_current < c_upper_bound)
+            c_lower_bound = np.maximum(c_lower_bound, np.max(np.where(failed, c_current, 0.0), axis=0))
+
+        return o_best_attack
     
     def _generate_bss(self, x_batch: np.ndarray, y_batch: np.ndarray, c_batch: np.ndarray) -> tuple:
         """
@@ -201,8 +286,8 @@ class ExpAttack(ElasticNet):
             return o_1 != o_2
 
         # Initialize the best distortions and best changed labels and best attacks
-        best_dist = np.inf * np.ones(x_batch.shape[0])
-        best_label = [-np.inf] * x_batch.shape[0]
+        best_dist = np.full(x_batch.shape[0], np.inf)
+        best_label = np.full(x_batch.shape[0], -np.inf)
         best_attack = x_batch.copy()
         # Implement the algorithm 1 in the EAD paper
         delta= np.zeros(x_batch.shape)
@@ -210,18 +295,23 @@ class ExpAttack(ElasticNet):
         upper=1.0-x_0
         lower=0.0-x_0
         x_adv=x_0+delta
-        self.eta=0.0
+        self.eta=np.zeros(x_batch.shape[0])
+        # samples still being optimised, finished ones are dropped from the batch
+        active=np.arange(x_batch.shape[0])
+        self._stopping.reset()
+        threshold=None
         for i_iter in range(self.max_iter):
             logger.debug("Iteration step %i out of %i", i_iter, self.max_iter)
             rnd=np.random.normal(size=x_0.shape)
-            rnd1=np.random.normal()
-            rnd=rnd/((np.linalg.norm(rnd)**2+rnd1**2)**0.5)
+            rnd1=np.random.normal(size=x_0.shape[0])
+            rnd_norm=(np.sum(rnd.reshape(x_0.shape[0],-1)**2,axis=1)+rnd1**2)**0.5
+            rnd=rnd/rnd_norm.reshape((-1,)+(1,)*(x_0.ndim-1))
             # updating rule
             grad = self._gradient_of_loss(target=y_batch, x=x_batch, x_adv=x_adv.astype(np.float32)+(self.smooth*rnd).astype(np.float32), c_weight=c_batch)
             
-            grad_val=np.abs(grad)
-            topk_val=np.quantile(grad_val,self.quantile)
-            grad[grad_val<topk_val]=0.0             
+            n=x_0.shape[0]
+            grad_flat,threshold=sparsify_topk(grad.reshape(n,-1),self.quantile,threshold,self.warm_start_tolerance)
+            grad=grad_flat.reshape(grad.shape)
             delta = self._md(grad,delta,lower,upper)
             
             x_adv=x_0+delta
@@ -229,47 +319,56 @@ class ExpAttack(ElasticNet):
             (logits, l1dist, l2dist, endist) = self._loss(x=x_batch, x_adv=x_adv.astype(np.float32))
 
             if self.decision_rule == "EN":
-                zip_set = zip(endist, logits)
+                distance = endist
             elif self.decision_rule == "L1":
-                zip_set = zip(l1dist, logits)
+                distance = l1dist
             elif self.decision_rule == "L2":
-                zip_set = zip(l2dist, logits)
+                distance = l2dist
             else:  # pragma: no cover
                 raise ValueError("The decision rule only supports `EN`, `L1`, `L2`.")
 
-            for j, (distance, label) in enumerate(zip_set):
-                if distance < best_dist[j] and compare(label, np.argmax(y_batch[j])):
-                    best_dist[j] = distance
-                    best_attack[j] = x_adv[j]
-                    best_label[j] = label
+            success = compare(logits, np.argmax(y_batch, axis=1))
+            update_best(best_dist, best_label, best_attack, active, distance, logits, x_adv, success)
+
+            if self._stopping.enabled:
+                keep=~self._stopping.update(best_dist)[active]
+                if not np.all(keep):
+                    active,x_batch,y_batch,c_batch,x_0,x_adv,delta,lower,upper,threshold,self.eta=compact(
+                        keep,active,x_batch,y_batch,c_batch,x_0,x_adv,delta,lower,upper,threshold,self.eta
+                    )
+                    if active.size==0:
+                        break
 
         return best_dist, best_label, best_attack
 
     def _md(self,g,x,lower,upper):
-        beta = 1.0 / g.size
-        init=False
-        if self.eta==0.0:
-            init=True
-            self.eta+=(np.linalg.norm((g).flatten(), ord=inf)**2)
+        # every sample is an independent mirror descent problem with its own step size
+        n=g.shape[0]
+        shape=x.shape
+        g,x,lower,upper=g.reshape(n,-1),x.reshape(n,-1),lower.reshape(n,-1),upper.reshape(n,-1)
+        beta = 1.0 / g.shape[1]
+        init=self.eta==0.0
+        self.eta=self.eta+np.where(init,np.max(np.abs(g),axis=1)**2,0.0)
         eta_t=np.sqrt(self.eta)/self.learning_rate
-        z=(np.log(np.abs(x) / beta + 1.0)) * np.sign(x) - g/eta_t
+        z=(np.log(np.abs(x) / beta + 1.0)) * np.sign(x) - g/eta_t[:,None]
         v_sgn = np.sign(z)
         a = beta
-        b = 2.0/eta_t
-        c = np.minimum(self.beta/eta_t- np.abs(z),0.0)
+        b = 2.0/eta_t[:,None]
+        c = np.minimum(self.beta/eta_t[:,None]- np.abs(z),0.0)
         abc=-c+np.log(a*b)+a*b
-        v_val = np.where(abc>=15.0,np.log(abc)-np.log(np.log(abc))+np.log(np.log(abc))/np.log(abc), lambertw( np.exp(abc), k=0).real)/b-a
+        # W(exp(abc)) evaluated directly in the reals. Earlier versions used the asymptotic expansion of W(abc) instead
+        # for abc >= 15 (2.26 instead of 17.16 at abc = 20), results in that regime differ from runs before the fix
+        v_val = wright_omega(abc)/b-a
         v = v_sgn * v_val
         v = np.clip(v, lower, upper)
 
-        
-        if not init:
-            D=np.maximum(np.linalg.norm(x.flatten(), ord=1),np.linalg.norm((v).flatten(), ord=1))
-            self.eta+=(eta_t/(D+1)*np.linalg.norm((x-v).flatten(), ord=1))**2
-            eta_t_1=np.sqrt(self.eta)/self.learning_rate
-            v=(1.0-eta_t/eta_t_1)*x+eta_t/eta_t_1*v
-        return v
-    
+        D=np.maximum(np.sum(np.abs(x),axis=1),np.sum(np.abs(v),axis=1))
+        self.eta=self.eta+np.where(init,0.0,(eta_t/(D+1)*np.sum(np.abs(x-v),axis=1))**2)
+        eta_t_1=np.sqrt(self.eta)/self.learning_rate
+        ratio=np.where(init,1.0,eta_t/eta_t_1)
+        v=(1.0-ratio[:,None])*x+ratio[:,None]*v
+        return v.reshape(shape)
+
     def _gradient_of_loss(
         self,
         target: np.ndarray,
@@ -315,7 +414,7 @@ class ExpAttack(ElasticNet):
         loss_gradient *= c_mult
         if self.smooth:
         #loss_gradient += 2 * (x_adv - x)
-            loss_gradient=loss_gradient-np.exp(-cost)/(1.0+np.exp(-cost))*loss_gradient
+            loss_gradient=loss_gradient-(np.exp(-cost)/(1.0+np.exp(-cost))).reshape(c_mult.shape)*loss_gradient
         # Set gradients where loss is constant to zero
         else:
             cond = (
@@ -4,11 +4,13 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 import numpy as np
 
 import logging
-from typing import TYPE_CHECKING
+import math
+from typing import TYPE_CHECKING, Tuple
 from cmath import inf
 from scipy.special import lambertw
 import numpy as np
 from tqdm.auto import trange
+import torch
 
 from art.estimators.estimator import BaseEstimator, LossGradientsMixin
 from art.estimators.classification.classifier import ClassifierMixin
@@ -24,6 +26,9 @@ from art.utils import (
     check_and_transform_label_format,
     is_probability
 )
+from adversarial_attack.compiled_step import CompiledStep
+from adversarial_attack.dtype_policy import DtypePolicy
+from adversarial_attack.exp_attack_utils import EarlyStopping, compact, sparsify_topk, update_best, kth_threshold_torch
 
 if TYPE_CHECKING:
     from art.utils import CLASSIFIER_LOSS_GRADIENTS_TYPE
@@ -41,7 +46,13 @@ class ExpAttackL1(EvasionAttack):
         "batch_size",
         "decision_rule",
         "verbose",
-        "quantile"
+        "quantile",
+        "backend",
+        "patience",
+        "target_distance",
+        "warm_start_tolerance",
+        "compile_step",
+        "dtype_policy"
     ]
     _estimator_requirements = (BaseEstimator, LossGradientsMixin, ClassifierMixin)
     _predefined_losses = [None, "cross_entropy", "difference_logits_ratio"]
@@ -58,7 +69,13 @@ class ExpAttackL1(EvasionAttack):
         smooth:float=-1.0,
         epsilon:float=12,
         quantile:float=0.90,
-        loss_type= "cross_entropy"
+        loss_type= "cross_entropy",
+        backend: str = "numpy",
+        patience: int | None = None,
+        target_distance: float | None = None,
+        warm_start_tolerance: float = 0.0,
+        compile_step: bool = False,
+        dtype_policy: DtypePolicy | None = None
     ) -> None:
         """
         Create an ElasticNet attack instance.
@@ -78,6 +95,16 @@ class ExpAttackL1(EvasionAttack):
         :param batch_size: Internal size of batches on which adversarial samples are generated.
         :param decision_rule: Decision rule. 'EN' means Elastic Net rule, 'L1' means L1 rule, 'L2' means L2 rule.
         :param verbose: Show progress bars.
+        :param backend: `numpy` runs the reference implementation through the ART estimator, `torch` keeps the whole
+               mirror descent loop as tensors on the device of the model.
+        :param patience: Stop optimising a sample after this many iterations without a smaller L1 distance.
+        :param target_distance: Stop optimising a sample once its L1 distance is below this value.
+        :param warm_start_tolerance: Reuse the sparsification threshold of the previous iteration as long as the
+               number of kept gradient entries deviates by at most this fraction of the input size. `0.0` disables it.
+        :param compile_step: Compile the update after every gradient (sparsification and mirror descent step) of the
+               torch backend with `torch.compile`, falling back to TorchScript. Compiled once per batch shape and dtype.
+        :param dtype_policy: Dtypes of the iterates (compute), of the log-sum-exp reductions of the projection
+               (accumulation) and of the returned examples (storage). Defaults to `DtypePolicy()`.
         """
 
         import torch
@@ -121,7 +148,9 @@ class ExpAttackL1(EvasionAttack):
                     """
                     return self.__call__(y_pred=input, y_true=target)
 
-            _loss_object_pt: torch.nn.modules.loss._Loss = CrossEntropyLossTorch(reduction="none")
+            # summed over the batch, so that the gradient of every sample does not depend on the batch size
+            _loss_object_pt: torch.nn.modules.loss._Loss = CrossEntropyLossTorch(reduction="sum")
+            _loss_object_indiv = CrossEntropyLossTorch(reduction="none")
 
 
 
@@ -139,9 +168,9 @@ class ExpAttackL1(EvasionAttack):
                 Callable class for Difference Logits Ratio loss in PyTorch.
                 """
 
-                def __init__(self):
+                def __init__(self, reduction="mean"):
                     super().__init__()
-                    self.reduction = "mean"
+                    self.reduction = reduction
 
                 def __call__(self, y_pred: torch.Tensor, y_true: torch.Tensor) -> torch.Tensor:
                     if isinstance(y_true, np.ndarray):
@@ -195,7 +224,8 @@ class ExpAttackL1(EvasionAttack):
                     """
                     return self.__call__(y_true=target, y_pred=input)
 
-            _loss_object_pt = DifferenceLogitsRatioPyTorch()
+            _loss_object_pt = DifferenceLogitsRatioPyTorch(reduction="sum")
+            _loss_object_indiv = DifferenceLogitsRatioPyTorch(reduction="none")
 
 
         else:
@@ -215,6 +245,7 @@ class ExpAttackL1(EvasionAttack):
             device_type=str(estimator._device),
         )
         super().__init__(estimator=estimator)
+        self._loss_object_indiv = _loss_object_indiv
         self._targeted = targeted
         self.learning_rate = learning_rate
         self.max_iter = max_iter
@@ -227,6 +258,19 @@ class ExpAttackL1(EvasionAttack):
         self.epsilon=epsilon
         self._check_params()
         self.loss_type=loss_type
+        if backend not in ["numpy", "torch"]:
+            raise ValueError("The backend has to be either `numpy` or `torch`.")
+        if backend == "torch" and not self.estimator.all_framework_preprocessing:
+            raise ValueError("The torch backend requires all preprocessing of the estimator to be PyTorch-based.")
+        self.backend=backend
+        self._stopping=EarlyStopping(patience=patience, target_distance=target_distance)
+        self.warm_start_tolerance=warm_start_tolerance
+        if compile_step and backend != "torch":
+            raise ValueError("The compiled step requires the torch backend.")
+        self.compile_step=compile_step
+        self._md_step = CompiledStep(md_step_torch) if compile_step else md_step_torch
+        self._md_init = CompiledStep(md_init_torch) if compile_step else md_init_torch
+        self.dtype_policy=dtype_policy if dtype_policy is not None else DtypePolicy()
 
     def generate(self, x: np.ndarray, y: np.ndarray | None = None, **kwargs) -> np.ndarray:
         """
@@ -240,7 +284,7 @@ class ExpAttackL1(EvasionAttack):
         """
         if y is not None:
             y = check_and_transform_label_format(y, nb_classes=self.estimator.nb_classes)
-        x_adv = x.astype(ART_NUMPY_DTYPE)
+        x_adv = x.astype(self.dtype_policy.numpy("compute"))
 
         # Assert that, if attack is targeted, y is provided:
         if self.targeted and y is None:  # pragma: no cover
@@ -261,7 +305,10 @@ class ExpAttackL1(EvasionAttack):
             batch_index_1, batch_index_2 = batch_id * self.batch_size, (batch_id + 1) * self.batch_size
             x_batch = x_adv[batch_index_1:batch_index_2]
             y_batch = y[batch_index_1:batch_index_2]
-            x_adv[batch_index_1:batch_index_2] = self._generate_bss(x_batch, y_batch)
+            if self.backend == "torch":
+                x_adv[batch_index_1:batch_index_2] = self._generate_bss_torch(x_batch, y_batch)
+            else:
+                x_adv[batch_index_1:batch_index_2] = self._generate_bss(x_batch, y_batch)
 
         # Apply clip
         if self.estimator.clip_values is not None:
@@ -270,12 +317,62 @@ class ExpAttackL1(EvasionAttack):
         # Compute success rate of the EAD attack
         logger.info(
             "Success rate of EAD attack: %.2f%%",
-            100 * compute_success(self.estimator, x, y, x_adv, self.targeted, batch_size=self.batch_size),
+            100 * compute_success(self.estimator, x, y, x_adv.astype(ART_NUMPY_DTYPE), self.targeted, batch_size=self.batch_size),
         )
-        return x_adv
+        return x_adv.astype(self.dtype_policy.numpy("storage"))
 
 
-    
+    def logits_loss_gradient(self, x, y) -> tuple:
+        """
+        Compute the logits, the per-sample loss and the gradient of the loss with respect to `x` from a single forward
+        and backward pass of the model.
+
+        :param x: Sample input, either an array or a tensor.
+        :param y: Target values (class labels) one-hot-encoded of shape (nb_samples, nb_classes).
+        :return: A tuple `(logits, loss, gradient)` of the same type as `x`.
+        """
+        import torch
+
+        is_tensor = isinstance(x, torch.Tensor)
+        device = self.estimator._device
+        self.estimator._model.train(mode=False)
+
+        if self.estimator.all_framework_preprocessing:
+            if is_tensor:
+                x_grad = x.detach().requires_grad_(True)
+            else:
+                x_grad = torch.from_numpy(np.asarray(x, dtype=self.dtype_policy.numpy("compute"))).to(device).requires_grad_(True)
+        elif not is_tensor:
+            # numpy preprocessing, its gradient is applied after the backward pass
+            x_preprocessed, _ = self.estimator._apply_preprocessing(
+                np.asarray(x, dtype=self.dtype_policy.numpy("compute")), y=None, fit=False, no_grad=True
+            )
+            x_grad = torch.from_numpy(x_preprocessed).to(device).requires_grad_(True)
+        else:
+            raise NotImplementedError("Combination of inputs and preprocessing not supported.")
+        y_t = y if isinstance(y, torch.Tensor) else torch.from_numpy(np.asarray(y, dtype=np.float32)).to(device)
+
+        with torch.enable_grad():
+            inputs = x_grad
+            if self.estimator.all_framework_preprocessing:
+                inputs, _ = self.estimator._apply_preprocessing(x_grad, y=None, fit=False, no_grad=False)
+            # the model runs in the dtype of its weights, the gradient arrives in the compute dtype
+            logits = self.estimator._model(inputs.to(self._model_dtype()))[-1]
+            loss = self._loss_object_indiv(logits, y_t)
+        grad = torch.autograd.grad(loss.sum(), [x_grad])[0]
+
+        if is_tensor:
+            return logits.detach(), loss.detach(), grad
+        grad = grad.cpu().numpy()
+        if not self.estimator.all_framework_preprocessing:
+            grad = self.estimator._apply_preprocessing_gradient(x, grad)
+        return logits.detach().cpu().numpy(), loss.detach().cpu().numpy(), grad
+
+    def _model_dtype(self):
+        for parameter in self.estimator.model.parameters():
+            return parameter.dtype
+        return self.dtype_policy.torch("compute")
+
     def _generate_bss(self, x_batch: np.ndarray, y_batch: np.ndarray) -> tuple:
         """
         Generate adversarial examples for a batch of inputs with a specific batch of constants.
@@ -292,65 +389,84 @@ class ExpAttackL1(EvasionAttack):
             return o_1 != o_2
 
         # Initialize the best distortions and best changed labels and best attacks
-        best_dist = np.inf * np.ones(x_batch.shape[0])
-        best_label = [-np.inf] * x_batch.shape[0]
+        best_dist = np.full(x_batch.shape[0], np.inf)
+        best_label = np.full(x_batch.shape[0], -np.inf)
         best_attack = x_batch.copy()
         x_0=x_batch.copy()
         upper=1.0-x_0
         lower=0.0-x_0
-        delta=np.zeros(x_0.shape)
+        delta=np.zeros(x_0.shape,dtype=x_0.dtype)
         #delta=np.random.uniform(low=0,high=1,size=x_0.shape)
         #dual_delta=self._reg_prim(delta,self.beta)
         #delta=self._project(np.abs(dual_delta),np.abs(dual_delta),self.beta,self.epsilon,lower,upper)
         x_adv=x_0+delta
-        self.eta=0.0
+        # every sample is an independent mirror descent problem with its own step size
+        self.eta=np.zeros(x_0.shape[0],dtype=x_0.dtype)
         #self.beta=self.epsilon/x_0.size
         #print(f"initial loss {self.estimator.compute_loss(x_adv.astype(ART_NUMPY_DTYPE),y_batch)}")
+
+        # samples still being optimised, finished ones are dropped from all per-sample arrays
+        active=np.arange(x_0.shape[0])
+        self._stopping.reset()
+
+        def update_iterate(x_adv, labels):
+            l1dist = np.sum(np.abs(x_0 - x_adv).reshape(x_0.shape[0], -1), axis=1)
+            success = compare(labels, np.argmax(y_active, axis=1))
+            update_best(best_dist, best_label, best_attack, active, l1dist, labels, x_adv, success)
+
+        y_active=y_batch
+        threshold=None
         for i_iter in range(self.max_iter):
 
-            grad = -self.estimator.loss_gradient(x_adv.astype(ART_NUMPY_DTYPE), y_batch) * (1 - 2 * int(self.targeted))
+            # the forward pass of the gradient also provides the predictions of the current iterate
+            predictions, _, grad = self.logits_loss_gradient(x_adv, y_active)
+            if i_iter > 0:
+                update_iterate(x_adv, np.argmax(predictions, axis=1))
+                if self._stopping.enabled:
+                    keep=~self._stopping.update(best_dist)[active]
+                    if not np.all(keep):
+                        active,x_0,x_adv,delta,lower,upper,y_active,grad,self.eta,threshold=compact(
+                            keep,active,x_0,x_adv,delta,lower,upper,y_active,grad,self.eta,threshold)
+                        if active.size==0:
+                            break
+            grad = -grad * (1 - 2 * int(self.targeted))
             
           
             #print(np.count_nonzero(grad))        
-            grad_val=np.abs(grad)
-            topk_val=np.quantile(grad_val,self.quantile)
-            grad[grad_val<topk_val]=0.0             
+            n=x_0.shape[0]
+            grad=grad.reshape(n,-1)
+            grad,threshold=sparsify_topk(grad,self.quantile,threshold,self.warm_start_tolerance)
             
-            delta = self._md(grad,delta, lower,upper)
+            delta = self._md(grad,delta.reshape(n,-1),lower.reshape(n,-1),upper.reshape(n,-1)).reshape(x_0.shape)
             #prob=(abs(delta)+self.beta)/np.sum(np.abs(delta)+self.beta)
 
             logger.debug("Iteration step %i out of %i", i_iter, self.max_iter)
             x_adv=x_0+delta
-            (logits, l1dist) = self._loss(x=x_batch, x_adv=x_adv.astype(ART_NUMPY_DTYPE))
-            zip_set = zip(l1dist, logits)
-            for j, (distance, label) in enumerate(zip_set):
-                if distance < best_dist[j] and compare(label, np.argmax(y_batch[j])):
-                    best_dist[j] = distance
-                    best_attack[j] = x_adv[j]
-                    best_label[j] = label
+        if active.size>0:
+            (logits, _) = self._loss(x=x_0, x_adv=x_adv.astype(ART_NUMPY_DTYPE))
+            update_iterate(x_adv, logits)
         return best_attack
 
     def _md(self,g,x,lower,upper):
         beta=self.beta
         dual_x=(np.log(np.abs(x) / beta + 1.0)) * np.sign(x)
-        dim=g.size
+        eta_t=np.sqrt(self.eta)/self.learning_rate
+        init=self.eta==0.0
         #first step try 
-        if self.eta==0.0:
-            eta_t=np.max(np.abs(g))/self.learning_rate
-            v=self._md_const(g,x,lower,upper,eta_t)
+        if np.any(init):
+            eta_0=np.max(np.abs(g),axis=1)/self.learning_rate
+            v=self._md_const(g,x,lower,upper,eta_0)
             dual_v= (np.log(np.abs(v) / beta + 1.0)) * np.sign(v)
-            dist=(eta_t**2)*np.vdot(x-v,dual_x-dual_v)
-            eta_t=np.sqrt(dist)   
-        else:
-            eta_t=np.sqrt(self.eta)/self.learning_rate
+            dist=(eta_0**2)*np.sum((x-v)*(dual_x-dual_v),axis=1)
+            eta_t=np.where(init,np.sqrt(dist),eta_t)
         #print(f"eta {eta_t}")
-        descent=g/eta_t
+        descent=g/eta_t[:,None]
         z=dual_x -descent
         z_sgn=np.sign(z)
         z_val=np.abs(z)
         v=self._project(z_sgn,z_val,beta,self.epsilon,lower,upper)
         dual_v= (np.log(np.abs(v) / beta + 1.0)) * np.sign(v)
-        dist=(eta_t**2)*np.vdot(x-v,dual_x-dual_v)
+        dist=(eta_t**2)*np.sum((x-v)*(dual_x-dual_v),axis=1)
         #print(f"gradient: {np.max(np.abs(g))}")
         #print(f"generalised gradient: {(dist*(eta_t**2))}")
         
@@ -359,8 +475,10 @@ class ExpAttackL1(EvasionAttack):
         self.eta+=dist
         #print(f"eta {np.max(np.abs(self.eta))}")
         eta_t_1=np.sqrt(self.eta)/self.learning_rate
-        if eta_t_1>eta_t:
-            v=(1.0-eta_t/eta_t_1)*x+eta_t/eta_t_1*v 
+        ratio=np.ones_like(eta_t)
+        shrink=eta_t_1>eta_t
+        ratio[shrink]=eta_t[shrink]/eta_t_1[shrink]
+        v=(1.0-ratio[:,None])*x+ratio[:,None]*v 
         return v
 
     def _reg(self,x,beta):
@@ -370,10 +488,10 @@ class ExpAttackL1(EvasionAttack):
 
 
     def _md_const(self,g,x,lower,upper,eta):
-        dim=g.size
+        dim=g.shape[1]
         beta=self.beta
         dual_x=(np.log(np.abs(x) / beta + 1.0)) * np.sign(x)
-        descent=g/eta/(self.epsilon+self.beta*dim)
+        descent=g/eta[:,None]/(self.epsilon+self.beta*dim)
         z=dual_x -descent
         z_sgn=np.sign(z)
         z_val=np.abs(z)
@@ -386,15 +504,24 @@ class ExpAttackL1(EvasionAttack):
         return v
 
     def _project(self, y_sgn,y_val, beta, D,l,u):
-        log_beta=np.log(beta)
-        y_val_max= np.max(y_val)
-        dim=y_val.size
+        """
+        Project every row onto its own L1 ball of radius `D` intersected with the box `[l, u]`. The threshold search
+        runs as a bisection over the sorted breakpoints of all rows at once.
+        """
+        # a python float, a numpy float64 scalar would promote float32 iterates
+        log_beta=float(np.log(beta))
+        dim=y_val.shape[1]
+        rows=np.arange(y_val.shape[0])
+        # the log-sum-exp reductions accumulate in the accumulation dtype
+        acc=self.dtype_policy.numpy("accumulation")
 
         # inside desicion set
-        if np.log(np.sum(np.exp(y_val+log_beta-y_val_max)))+y_val_max<=np.log(D+dim*beta):
-            phi=y_sgn*(np.exp(y_val+log_beta)-beta)
-            if np.all(phi>=l) and np.all(phi<=u):
-                return phi
+        y_val_max=np.max(y_val,axis=1)
+        phi_inside=y_sgn*(np.exp(y_val+log_beta)-beta)
+        inside=np.log(np.sum(np.exp(y_val+log_beta-y_val_max[:,None]),axis=1,dtype=acc))+y_val_max<=np.log(D+dim*beta)
+        inside&=np.all(phi_inside>=l,axis=1)&np.all(phi_inside<=u,axis=1)
+        if np.all(inside):
+            return phi_inside
         
         # otherwise it has to be mapped to l1 sphere
         c=np.where(y_sgn<=0,np.abs(l),u)
@@ -402,41 +529,46 @@ class ExpAttackL1(EvasionAttack):
         lam_l=-y_val
         lam_u=np.minimum(0,-y_val-log_beta+log_c_beta)
     
-        lam=np.stack((lam_l,lam_u))
-        lam=lam.reshape(-1)
-        sort_idx=np.argsort(lam)
-        idx_l=0
-        idx_u=sort_idx.size-1
-        while idx_u-idx_l>1:
+        lam=np.sort(np.concatenate((lam_l,lam_u),axis=1),axis=1)
+        idx_l=np.zeros(lam.shape[0],dtype=int)
+        idx_u=np.full(lam.shape[0],lam.shape[1]-1)
+        searching=idx_u-idx_l>1
+        while np.any(searching):
             idx=(idx_u+idx_l)//2
-            normaliser=lam[sort_idx[idx]]
-            phi=np.exp(np.maximum(np.minimum(y_val+log_beta+normaliser,log_c_beta),log_beta))-beta
-            radius=np.sum(phi)
-            if radius>D:
-                idx_u=idx
-            elif radius<D:
-                idx_l=idx
-            else:
-                idx_u=idx
-                idx_l=idx
-        if lam[sort_idx[idx_l]]<0:
-            phi[lam_l>=lam[sort_idx[idx_u]]]=0
-            phi[lam_u<=lam[sort_idx[idx_l]]]=c[lam_u<=lam[sort_idx[idx_l]]]
-            active_index=np.logical_and(lam_l<lam[sort_idx[idx_u]] ,lam_u>lam[sort_idx[idx_l]])
-            num_active=np.count_nonzero(active_index)
-            y_bound=np.sum(c[lam_u<=lam[sort_idx[idx_l]]])
-            if num_active!=0:
+            normaliser=lam[rows,idx]
+            phi=np.exp(np.maximum(np.minimum(y_val+log_beta+normaliser[:,None],log_c_beta),log_beta))-beta
+            radius=np.sum(phi,axis=1)
+            idx_u=np.where(searching&(radius>=D),idx,idx_u)
+            idx_l=np.where(searching&(radius<=D),idx,idx_l)
+            searching=idx_u-idx_l>1
+        lam_lower=lam[rows,idx_l][:,None]
+        lam_upper=lam[rows,idx_u][:,None]
+
+        # the box-clipped point already lies in the ball
+        phi=np.exp(np.maximum(np.minimum(y_val+log_beta+lam_lower,log_c_beta),log_beta))-beta
+        shrink=lam_lower[:,0]<0
+        capped=(lam_u<=lam_lower)&shrink[:,None]
+        active=(lam_l<lam_upper)&(lam_u>lam_lower)&shrink[:,None]
+        phi[(lam_l>=lam_upper)&shrink[:,None]]=0
+        phi[capped]=c[capped]
+        num_active=np.count_nonzero(active,axis=1)
+        y_bound=np.sum(np.where(capped,c,0.0),axis=1)
+        if np.any(active):
             #nummerical instability 
                 #if(y_bound>D):
                     #print(f"norm of active coordinatte {y_bound} larger than radius")
                     #assert(y_bound<=D)
-                y_max_active=np.max(y_val[active_index])
-                normaliser=np.log(np.sum(np.exp(y_val[active_index]-y_max_active+log_beta)))-np.log(D-y_bound+num_active*beta)+y_max_active
-                phi[active_index]=np.exp(y_val[active_index]+np.log(beta)-normaliser)-beta
+            y_active=np.where(active,y_val,-np.inf)
+            y_max_active=np.max(y_active,axis=1,keepdims=True)
+            y_max_active[~np.isfinite(y_max_active)]=0.0
+            with np.errstate(divide="ignore",invalid="ignore",over="ignore"):
+                normaliser=np.log(np.sum(np.exp(y_active-y_max_active+log_beta),axis=1,keepdims=True,dtype=acc))-np.log(D-y_bound+num_active*beta)[:,None]+y_max_active
+                phi[active]=(np.exp(y_val+log_beta-normaliser)-beta)[active]
         #radius=np.sum(phi)
         #if np.abs(radius)>self.epsilon+1.0: 
         #print(f"radius {np.sum(np.abs(phi))}")
         phi=phi*y_sgn
+        phi[inside]=phi_inside[inside]
         return phi
     
 
@@ -453,3 +585,244 @@ class ExpAttackL1(EvasionAttack):
         l1dist = np.sum(np.abs(x - x_adv).reshape(x.shape[0], -1), axis=1)
         predictions = self.estimator.predict(np.array(x_adv, dtype=ART_NUMPY_DTYPE), batch_size=self.batch_size)
         return np.argmax(predictions, axis=1), l1dist
+
+    def _generate_bss_torch(self, x_batch: np.ndarray, y_batch: np.ndarray) -> np.ndarray:
+        """
+        Tensor version of `_generate_bss`. The iterates, the mirror descent state and the best-iterate bookkeeping
+        stay on the device of the model, only the final adversarial examples are copied back.
+
+        :param x_batch: A batch of original examples.
+        :param y_batch: A batch of targets (0-1 hot).
+        :return: A batch of adversarial examples.
+        """
+        import torch
+
+        device = self.estimator._device
+        self.estimator.model.eval()
+
+        x_0 = torch.from_numpy(np.asarray(x_batch, dtype=self.dtype_policy.numpy("compute"))).to(device)
+        y_t = torch.from_numpy(np.asarray(y_batch, dtype=np.float32)).to(device)
+        y_idx = torch.argmax(y_t, dim=1)
+
+        best_dist = torch.full((x_0.shape[0],), float("inf"), dtype=x_0.dtype, device=device)
+        best_attack = x_0.clone()
+        upper = 1.0 - x_0
+        lower = 0.0 - x_0
+        delta = torch.zeros_like(x_0)
+        x_adv = x_0 + delta
+        # every sample is an independent mirror descent problem with its own step size
+        self.eta = torch.zeros(x_0.shape[0], dtype=x_0.dtype, device=device)
+        eta_0 = None
+
+        # samples still being optimised, finished ones are dropped from all per-sample tensors
+        active = torch.arange(x_0.shape[0], device=device)
+        self._stopping.reset()
+        threshold = None
+
+        def update_best(x_adv, labels):
+            l1dist = (x_0 - x_adv).abs().reshape(x_0.shape[0], -1).sum(dim=1)
+            if self.targeted:
+                success = labels == y_idx
+            else:
+                success = labels != y_idx
+            improved = success & (l1dist < best_dist[active])
+            best_dist[active] = torch.where(improved, l1dist, best_dist[active])
+            best_attack[active] = torch.where(
+                improved.view(-1, *([1] * (x_0.dim() - 1))), x_adv, best_attack[active]
+            )
+
+        for i_iter in range(self.max_iter):
+            # the forward pass of the gradient also provides the predictions of the current iterate
+            logits, _, grad = self.logits_loss_gradient(x_adv, y_t)
+            if i_iter > 0:
+                update_best(x_adv, torch.argmax(logits, dim=1))
+                if self._stopping.enabled:
+                    keep = ~self._stopping.update(best_dist)[active]
+                    if not bool(keep.all()):
+                        active, x_0, x_adv, delta, lower, upper, y_t, y_idx, grad, self.eta, eta_0, threshold = compact(
+                            keep, active, x_0, x_adv, delta, lower, upper, y_t, y_idx, grad, self.eta, eta_0, threshold
+                        )
+                        if active.numel() == 0:
+                            break
+            grad = -grad * (1 - 2 * int(self.targeted))
+
+            rows = x_0.shape[0]
+            grad = grad.reshape(rows, -1)
+            quantile = self.quantile
+            if self.warm_start_tolerance > 0.0:
+                # the warm-started threshold depends on the previous iteration, sparsify outside of the step
+                grad, threshold = sparsify_topk(grad, self.quantile, threshold, self.warm_start_tolerance)
+                quantile = 0.0
+
+            if i_iter == 0:
+                # step size of the first step, kept for the rows whose statistics are still zero
+                eta_0 = self._md_init(
+                    grad, delta.reshape(rows, -1), lower.reshape(rows, -1), upper.reshape(rows, -1),
+                    quantile, float(self.beta), float(self.epsilon), float(self.learning_rate),
+                    self.dtype_policy.torch("accumulation")
+                )
+            delta, self.eta = self._md_step(
+                grad, delta.reshape(rows, -1), lower.reshape(rows, -1), upper.reshape(rows, -1), self.eta, eta_0,
+                quantile, float(self.beta), float(self.epsilon), float(self.learning_rate),
+                self.dtype_policy.torch("accumulation")
+            )
+            delta = delta.reshape(x_0.shape)
+
+            logger.debug("Iteration step %i out of %i", i_iter, self.max_iter)
+            x_adv = x_0 + delta
+        if active.numel() > 0:
+            labels, _ = self._loss_torch(x=x_0, x_adv=x_adv)
+            update_best(x_adv, labels)
+        return best_attack.cpu().numpy()
+
+    def _loss_torch(self, x, x_adv) -> tuple:
+        """
+        Tensor version of `_loss`.
+
+        :param x: A tensor with the original input.
+        :param x_adv: A tensor with the adversarial input.
+        :return: A tuple holding the current predicted labels and l1 distances.
+        """
+        import torch
+
+        l1dist = (x - x_adv).abs().reshape(x.shape[0], -1).sum(dim=1)
+        with torch.no_grad():
+            x_preprocessed, _ = self.estimator._apply_preprocessing(x_adv, y=None, fit=False, no_grad=True)
+            predictions = self.estimator._model(x_preprocessed.to(self._model_dtype()))[-1]
+        return torch.argmax(predictions, dim=1), l1dist
+
+
+def _dual_torch(x, beta: float):
+    return torch.log(x.abs() / beta + 1.0) * torch.sign(x)
+
+
+def _sparsify_torch(grad, quantile: float):
+    if quantile > 0.0:
+        threshold = kth_threshold_torch(grad.abs(), quantile * (grad.shape[1] - 1))
+        grad = torch.where(grad.abs() < threshold[:, None], torch.zeros_like(grad), grad)
+    return grad
+
+
+def md_init_torch(grad, x, lower, upper, quantile: float, beta: float, epsilon: float, learning_rate: float,
+                  acc_dtype: torch.dtype) -> torch.Tensor:
+    """
+    Step size of the first mirror descent step of every sample, estimated with a trial step of constant step size. It
+    is computed once, before the first call of `md_step_torch`, with the same arguments.
+
+    :return: The step size `eta_t` of the first step of every sample.
+    """
+    g = _sparsify_torch(grad, quantile)
+    eta_0 = g.abs().amax(dim=1) / learning_rate
+    v = md_const_torch(g, x, lower, upper, eta_0, beta, epsilon, acc_dtype)
+    dist = (eta_0**2) * ((x - v) * (_dual_torch(x, beta) - _dual_torch(v, beta))).sum(dim=1)
+    return torch.sqrt(dist)
+
+
+def md_step_torch(grad, x, lower, upper, eta, eta_0, quantile: float, beta: float, epsilon: float,
+                  learning_rate: float, acc_dtype: torch.dtype) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Post-gradient update of the torch backend of `ExpAttackL1`: per-sample top-k sparsification of the gradient
+    followed by a mirror descent step. Pure and scriptable, so it can be compiled into a single graph.
+
+    :param grad: Gradient of shape `(nb_samples, nb_features)`.
+    :param x: Current perturbation of shape `(nb_samples, nb_features)`.
+    :param lower: Lower box bound of the perturbation.
+    :param upper: Upper box bound of the perturbation.
+    :param eta: Accumulated step size statistics of every sample, `0` before the first step.
+    :param eta_0: Step size of the first step of every sample from `md_init_torch`, used where `eta` is `0`.
+    :param quantile: Fraction of the gradient entries of every row that is set to zero, `0.0` skips the
+           sparsification.
+    :param acc_dtype: Dtype of the log-sum-exp reductions of the projection.
+    :return: A tuple of the new perturbation and the updated step size statistics.
+    """
+    grad = _sparsify_torch(grad, quantile)
+    return md_torch(grad, x, lower, upper, eta, eta_0, beta, epsilon, learning_rate, acc_dtype)
+
+
+def md_torch(g, x, lower, upper, eta, eta_0, beta: float, epsilon: float, learning_rate: float,
+             acc_dtype: torch.dtype) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Tensor version of `ExpAttackL1._md`, every row of `g` and `x` is an independent problem with its own step size.
+    """
+    dual_x = _dual_torch(x, beta)
+    # the first step uses the step size of the trial step of `md_init_torch`
+    eta_t = torch.where(eta == 0.0, eta_0, torch.sqrt(eta) / learning_rate)
+    descent = g / eta_t[:, None]
+    z = dual_x - descent
+    v = project_torch(torch.sign(z), z.abs(), beta, epsilon, lower, upper, acc_dtype)
+    dist = (eta_t**2) * ((x - v) * (dual_x - _dual_torch(v, beta))).sum(dim=1)
+    eta = eta + dist
+    eta_t_1 = torch.sqrt(eta) / learning_rate
+    ratio = torch.where(eta_t_1 > eta_t, eta_t / eta_t_1, torch.ones_like(eta_t))[:, None]
+    return (1.0 - ratio) * x + ratio * v, eta
+
+
+def md_const_torch(g, x, lower, upper, eta, beta: float, epsilon: float, acc_dtype: torch.dtype):
+    """
+    Tensor version of `ExpAttackL1._md_const` with one constant step size `eta` per row.
+    """
+    dim = g.shape[1]
+    descent = g / eta[:, None] / (epsilon + beta * dim)
+    z = _dual_torch(x, beta) - descent
+    return project_torch(torch.sign(z), z.abs(), beta, epsilon, lower, upper, acc_dtype)
+
+
+def _radius_torch(y_val, beta: float, log_c_beta, normaliser) -> Tuple[torch.Tensor, torch.Tensor]:
+    log_beta = math.log(beta)
+    phi = torch.exp(torch.maximum(torch.minimum(y_val + log_beta + normaliser[:, None], log_c_beta),
+                                  torch.full_like(y_val, log_beta))) - beta
+    return phi, phi.sum(dim=1)
+
+
+def project_torch(y_sgn, y_val, beta: float, D: float, l, u, acc_dtype: torch.dtype):
+    """
+    Tensor version of `ExpAttackL1._project`. Each row is projected onto its own L1 ball of radius `D` intersected with
+    the box `[l, u]`. The search for the normaliser runs as a fixed number of bisection steps over the sorted
+    breakpoints of all rows at once, so no values have to be synchronised with the host. The log-sum-exp reductions
+    run in `acc_dtype`.
+    """
+    log_beta = math.log(beta)
+    dim = y_val.shape[1]
+
+    # inside desicion set
+    phi_inside = y_sgn * (torch.exp(y_val + log_beta) - beta)
+    inside = torch.logsumexp((y_val + log_beta).to(acc_dtype), dim=1) <= math.log(D + dim * beta)
+    inside = inside & ((phi_inside >= l) & (phi_inside <= u)).all(dim=1)
+
+    # otherwise it has to be mapped to l1 sphere
+    c = torch.where(y_sgn <= 0, l.abs(), u)
+    log_c_beta = torch.log(c + beta)
+    lam_l = -y_val
+    lam_u = torch.clamp(-y_val - log_beta + log_c_beta, max=0.0)
+    lam = torch.sort(torch.cat((lam_l, lam_u), dim=1), dim=1)[0]
+
+    idx_l = torch.zeros(lam.shape[0], dtype=torch.long, device=lam.device)
+    idx_u = torch.full_like(idx_l, lam.shape[1] - 1)
+    # ceil(log2(#breakpoints)) + 1 bisection steps
+    n_steps = 1
+    while (1 << (n_steps - 1)) < lam.shape[1]:
+        n_steps += 1
+    for _ in range(n_steps):
+        searching = idx_u - idx_l > 1
+        idx = torch.div(idx_u + idx_l, 2, rounding_mode="floor")
+        _, r = _radius_torch(y_val, beta, log_c_beta, lam.gather(1, idx[:, None]).squeeze(1))
+        idx_u = torch.where(searching & (r >= D), idx, idx_u)
+        idx_l = torch.where(searching & (r <= D), idx, idx_l)
+
+    lam_lower = lam.gather(1, idx_l[:, None])
+    lam_upper = lam.gather(1, idx_u[:, None])
+    # the box-clipped point lies in the ball, no shrinkage necessary
+    phi_clip, _ = _radius_torch(y_val, beta, log_c_beta, lam_lower.squeeze(1))
+
+    capped = lam_u <= lam_lower
+    active = (lam_l < lam_upper) & ~capped
+    num_active = active.sum(dim=1)
+    y_bound = torch.where(capped, c, torch.zeros_like(c)).sum(dim=1)
+    log_active = torch.where(active, y_val + log_beta, torch.full_like(y_val, -float("inf")))
+    normaliser = torch.logsumexp(log_active.to(acc_dtype), dim=1) - torch.log((D - y_bound + num_active * beta).to(acc_dtype))
+    phi = torch.where(active, (torch.exp(y_val + log_beta - normaliser[:, None]) - beta).to(y_val.dtype),
+                      torch.zeros_like(y_val))
+    phi = torch.where(capped, c, phi)
+    phi = torch.where(lam_lower < 0, phi, phi_clip)
+    phi = phi * y_sgn
+    return torch.where(inside[:, None], phi_inside, phi)
@@ -24,6 +24,8 @@ from art.utils import (
     check_and_transform_label_format,
     is_probability
 )
+from adversarial_attack.dtype_policy import DtypePolicy
+from adversarial_attack.exp_attack_utils import EarlyStopping, sparsify_topk
 
 if TYPE_CHECKING:
     from art.utils import CLASSIFIER_LOSS_GRADIENTS_TYPE
@@ -40,7 +42,10 @@ class ExpAttackL1Ada(EvasionAttack):
         "epsilon",
         "decision_rule",
         "quantile",
-        "verbose"
+        "verbose",
+        "patience",
+        "target_distance",
+        "warm_start_tolerance"
     ]
     _estimator_requirements = (BaseEstimator, LossGradientsMixin, ClassifierMixin)
     _predefined_losses = [None, "cross_entropy", "difference_logits_ratio"]
@@ -55,7 +60,11 @@ class ExpAttackL1Ada(EvasionAttack):
         verbose: bool = True,
         epsilon:float=12,
         quantile:float=0.0,
-        loss_type= "cross_entropy"
+        loss_type= "cross_entropy",
+        patience: int | None = None,
+        target_distance: float | None = None,
+        warm_start_tolerance: float = 0.0,
+        dtype_policy: DtypePolicy | None = None
     ) -> None:
         """
         Create an ElasticNet attack instance.
@@ -75,6 +84,12 @@ class ExpAttackL1Ada(EvasionAttack):
         :param batch_size: Internal size of batches on which adversarial samples are generated.
         :param decision_rule: Decision rule. 'EN' means Elastic Net rule, 'L1' means L1 rule, 'L2' means L2 rule.
         :param verbose: Show progress bars.
+        :param patience: Stop optimising a sample after this many iterations without a smaller L1 distance.
+        :param target_distance: Stop optimising a sample once its L1 distance is below this value.
+        :param warm_start_tolerance: Reuse the sparsification threshold of the previous iteration as long as the
+               number of kept gradient entries deviates by at most this fraction of the input size. `0.0` disables it.
+        :param dtype_policy: Dtypes of the iterates (compute), of the log-sum-exp reductions of the projection
+               (accumulation) and of the returned examples (storage). Defaults to `DtypePolicy()`.
         """
 
         import torch
@@ -222,6 +237,9 @@ class ExpAttackL1Ada(EvasionAttack):
         self._check_params()
         self.loss_type=loss_type
         self.quantile=quantile
+        self._stopping=EarlyStopping(patience=patience, target_distance=target_distance)
+        self.warm_start_tolerance=warm_start_tolerance
+        self.dtype_policy=dtype_policy if dtype_policy is not None else DtypePolicy()
 
     def generate(self, x: np.ndarray, y: np.ndarray | None = None, **kwargs) -> np.ndarray:
         """
@@ -235,7 +253,7 @@ class ExpAttackL1Ada(EvasionAttack):
         """
         if y is not None:
             y = check_and_transform_label_format(y, nb_classes=self.estimator.nb_classes)
-        x_batch = x.astype(ART_NUMPY_DTYPE)
+        x_batch = x.astype(self.dtype_policy.numpy("compute"))
 
         # Assert that, if attack is targeted, y is provided:
         if self.targeted and y is None:  # pragma: no cover
@@ -260,7 +278,7 @@ class ExpAttackL1Ada(EvasionAttack):
         if self.estimator.clip_values is not None:
             x_adv = np.clip(x_adv, self.estimator.clip_values[0], self.estimator.clip_values[1])
 
-        return x_adv
+        return x_adv.astype(self.dtype_policy.numpy("storage"))
 
 
     
@@ -288,15 +306,16 @@ class ExpAttackL1Ada(EvasionAttack):
         delta=np.zeros(x_0.shape)
         x_adv=x_0+delta
         success=[]
+        self._stopping.reset()
+        threshold=None
 
         for i_iter in range(self.max_iter):
 
             grad = -self.estimator.loss_gradient(x_adv.astype(ART_NUMPY_DTYPE), y_batch) * (1 - 2 * int(self.targeted))
             
           
-            grad_val=np.abs(grad)
-            topk_val=np.quantile(grad_val,self.quantile)
-            grad[grad_val<topk_val]=0.0             
+            grad_flat,threshold=sparsify_topk(grad.reshape(1,-1),self.quantile,threshold,self.warm_start_tolerance)
+            grad=grad_flat.reshape(grad.shape)
             
             delta = self._md(grad,delta, lower,upper)
             
@@ -305,9 +324,11 @@ class ExpAttackL1Ada(EvasionAttack):
             x_adv=x_0+delta
             logits, l1dist = self._loss(x=x_batch, x_adv=x_adv.astype(ART_NUMPY_DTYPE))
             if l1dist < best_dist and compare(logits, np.argmax(y_batch)):
-                best_dist = logits
+                best_dist = l1dist
                 best_attack = x_adv
-            success.append(compare(logits, np.argmax(y_batch[j])))
+            success.append(compare(logits, np.argmax(y_batch)))
+            if self._stopping.enabled and self._stopping.update(np.array([best_dist]))[0]:
+                break
         return best_attack, np.array(success)
 
     def _md(self,g,x,lower,upper):
@@ -330,12 +351,14 @@ class ExpAttackL1Ada(EvasionAttack):
 
 
     def _project(self, y_sgn,y_val, beta, D,l,u):
-        log_beta=np.log(beta)
+        log_beta=float(np.log(beta))
         y_val_max= np.max(y_val)
         dim=y_val.size
+        # the log-sum-exp reductions accumulate in the accumulation dtype
+        acc=self.dtype_policy.numpy("accumulation")
 
         # inside desicion set
-        if np.log(np.sum(np.exp(y_val+log_beta-y_val_max)))+y_val_max<=np.log(D+dim*beta):
+        if np.log(np.sum(np.exp(y_val+log_beta-y_val_max),dtype=acc))+y_val_max<=np.log(D+dim*beta):
             phi=y_sgn*(np.exp(y_val+log_beta)-beta)
             if np.all(phi>=l) and np.all(phi<=u):
                 return phi
@@ -375,8 +398,8 @@ class ExpAttackL1Ada(EvasionAttack):
                     #print(f"norm of active coordinatte {y_bound} larger than radius")
                     #assert(y_bound<=D)
                 y_max_active=np.max(y_val[active_index])
-                normaliser=np.log(np.sum(np.exp(y_val[active_index]-y_max_active+log_beta)))-np.log(D-y_bound+num_active*beta)+y_max_active
-                phi[active_index]=np.exp(y_val[active_index]+np.log(beta)-normaliser)-beta
+                normaliser=np.log(np.sum(np.exp(y_val[active_index]-y_max_active+log_beta),dtype=acc))-np.log(D-y_bound+num_active*beta)+y_max_active
+                phi[active_index]=np.exp(y_val[active_index]+log_beta-normaliser)-beta
         #radius=np.sum(phi)
         #if np.abs(radius)>self.epsilon+1.0: 
         #print(f"radius {np.sum(np.abs(phi))}")
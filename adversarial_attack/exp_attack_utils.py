@@ -0,0 +1,192 @@
+"""
+Helpers shared by the exp attacks (`ExpAttack`, `ExpAttackL1` and `ExpAttackL1Ada`).
+"""
+from __future__ import annotations
+
+import math
+
+import numpy as np
+
+class EarlyStopping:
+    """
+    Per-sample stopping policy. A sample is finished once it has gone `patience` iterations without improving its best
+    adversarial distance, or as soon as that distance drops below `target_distance`. Samples without any successful
+    iterate so far are never stopped. Works on numpy arrays and on torch tensors.
+    """
+
+    def __init__(self, patience: int | None = None, target_distance: float | None = None) -> None:
+        """
+        :param patience: Number of iterations without improvement after which a sample is stopped. `None` disables it.
+        :param target_distance: Stop a sample once its best distance is below this value. `None` disables it.
+        """
+        if patience is not None and (not isinstance(patience, int) or patience <= 0):
+            raise ValueError("The patience has to be a positive integer or None.")
+        if target_distance is not None and target_distance < 0:
+            raise ValueError("The target distance has to be non-negative or None.")
+        self.patience = patience
+        self.target_distance = target_distance
+        self._best = None
+        self._stale = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.patience is not None or self.target_distance is not None
+
+    def reset(self) -> None:
+        self._best = None
+        self._stale = None
+
+    def update(self, best_dist):
+        """
+        Register the best distances after an iteration.
+
+        :param best_dist: Best distance found so far for every sample, `inf` if no adversarial example was found yet.
+        :return: Boolean mask of the samples that can be stopped.
+        """
+        found = best_dist < float("inf")
+        if self._best is None:
+            self._stale = found * 0
+        else:
+            improved = best_dist < self._best
+            self._stale = (self._stale + 1) * (found & ~improved)
+        self._best = best_dist + 0
+
+        done = found & False
+        if self.patience is not None:
+            done = done | (self._stale >= self.patience)
+        if self.target_distance is not None:
+            done = done | (best_dist < self.target_distance)
+        return done
+
+
+def compact(keep, *arrays):
+    """
+    Drop finished samples from the active batch.
+
+    :param keep: Boolean mask over the active samples.
+    :param arrays: Arrays or tensors whose first axis runs over the active samples, `None` is passed through.
+    :return: The arrays restricted to the samples in `keep`.
+    """
+    return tuple(None if array is None else array[keep] for array in arrays)
+
+
+def update_best(best_dist, best_label, best_attack, rows, distance, label, x_adv, success):
+    """
+    Keep the closest successful iterate of every sample. The buffers are updated in place, only the rows that improve
+    are written.
+
+    The masked assignment is not faster than the per-sample loop it replaces: it gathers the improved rows into a
+    temporary before writing them. With half of the samples improving it takes 0.4x, 0.9x and 0.7x the speed of the
+    loop at batch sizes 1, 32 and 256 (3x32x32 inputs), it only wins with few improving rows in large batches (2x at
+    batch size 256 with 5% improving). See `validation/benchmark_best_update.py`.
+
+    :param best_dist: Buffer with the best distance of every sample of the batch.
+    :param best_label: Buffer with the label of the best iterate of every sample of the batch.
+    :param best_attack: Buffer with the best iterate of every sample of the batch.
+    :param rows: Positions of the current iterates in the buffers.
+    :param distance: Distances of the current iterates.
+    :param label: Predicted labels of the current iterates.
+    :param x_adv: Current iterates.
+    :param success: Boolean mask of the current iterates that are adversarial.
+    :return: Boolean mask of the current iterates that improved their sample.
+    """
+    improved = success & (distance < best_dist[rows])
+    index = np.flatnonzero(improved)
+    if index.size > 0:
+        best_dist[rows[index]] = distance[index]
+        best_label[rows[index]] = label[index]
+        best_attack[rows[index]] = x_adv[index]
+    return improved
+
+
+def sparsify_topk(grad, quantile: float, threshold=None, tolerance: float = 0.0) -> tuple:
+    """
+    Per-sample top-k sparsification of a gradient. In every row the entries whose magnitude is below the row's
+    `quantile` (linear interpolation as in `np.quantile`) are set to zero. The threshold is found with a linear-time
+    selection (`np.partition` / `kthvalue`) instead of a full sort. Works on numpy arrays and on torch tensors.
+
+    :param grad: Gradient of shape `(nb_samples, nb_features)`, modified in place.
+    :param quantile: Fraction of the entries of every row that is set to zero.
+    :param threshold: Thresholds of the previous iteration, used as a warm start if given.
+    :param tolerance: A row keeps its previous threshold as long as the number of entries it keeps deviates by at most
+           this fraction of `nb_features` from the exact top-k count. `0.0` recomputes every threshold.
+    :return: A tuple of the sparsified gradient and the thresholds of all rows.
+    """
+    d = grad.shape[1]
+    grad_val = abs(grad)
+    pos = quantile * (d - 1)
+
+    if threshold is None or tolerance <= 0.0:
+        threshold = _kth_threshold(grad_val, pos)
+    else:
+        # a reused threshold has to keep roughly as many entries as the exact one
+        kept = (grad_val >= threshold[:, None]).sum(1)
+        recompute = abs(kept - (d - pos)) > tolerance * d
+        if recompute.any():
+            threshold = threshold + 0
+            threshold[recompute] = _kth_threshold(grad_val[recompute], pos)
+
+    grad[grad_val < threshold[:, None]] = 0.0
+    return grad, threshold
+
+
+def _kth_threshold(v, pos: float):
+    k_lower, k_upper = int(np.floor(pos)), int(np.ceil(pos))
+    if isinstance(v, np.ndarray):
+        part = np.partition(v, (k_lower, k_upper), axis=1)
+        v_lower, v_upper = part[:, k_lower], part[:, k_upper]
+    else:
+        return kth_threshold_torch(v, pos)
+    return v_lower + (v_upper - v_lower) * (pos - k_lower)
+
+
+def kth_threshold_torch(v, pos: float):
+    """
+    Torch version of the threshold of `sparsify_topk`. Scriptable, so it can be part of a compiled step.
+    """
+    # `torch.quantile` is limited in input size
+    k_lower, k_upper = int(math.floor(pos)), int(math.ceil(pos))
+    v_lower = v.kthvalue(k_lower + 1, dim=1)[0]
+    if k_upper == k_lower:
+        return v_lower
+    v_upper = v.kthvalue(k_upper + 1, dim=1)[0]
+    return v_lower + (v_upper - v_lower) * (pos - k_lower)
+
+
+def wright_omega(a, iterations: int = 2):
+    """
+    Real Wright omega function `w = W(exp(a))`, the solution of `w + log(w) = a`, for numpy arrays and torch tensors.
+    Avoids the complex-valued `scipy.special.lambertw` and the overflow of `exp(a)`. Every element is seeded with the
+    approximation of its own range (asymptotic expansion for large `a`, `exp(a)` for small `a`) and refined with
+    fourth-order Fritsch-Shafer-Crowley iterations, two of which reach double precision.
+
+    :param a: Real argument.
+    :param iterations: Number of refinement steps.
+    :return: `W(exp(a))` with the shape and type of `a`.
+    """
+    if isinstance(a, np.ndarray):
+        xp = np
+    else:
+        import torch
+
+        xp = torch
+
+    w = a * 0
+    large = a > 1.0
+    a_large = a[large]
+    log_a = xp.log(a_large)
+    w[large] = a_large - log_a + log_a / a_large
+    # below -40 `exp(a)` is exact to double precision and the refinement would take the log of denormals
+    tiny = a < -40.0
+    small = ~large & ~tiny
+    w[small] = xp.log1p(xp.exp(a[small]))
+    w[tiny] = xp.exp(a[tiny])
+
+    refine = ~tiny
+    w_r, a_r = w[refine], a[refine]
+    for _ in range(iterations):
+        r = a_r - w_r - xp.log(w_r)
+        s = (1.0 + w_r) * (1.0 + w_r + 2.0 * r / 3.0)
+        w_r = w_r * (1.0 + r / (1.0 + w_r) * (s - r / 2.0) / (s - r))
+    w[refine] = w_r
+    return w
@@ -23,7 +23,9 @@ This module implements the Geometric Decision-based Attack (GeoDA), a black-box
 from __future__ import annotations
 
 import os
+import json
 import math
+import hashlib
 import logging
 from typing import TYPE_CHECKING
 
@@ -59,6 +61,9 @@ class GeoDA(EvasionAttack):
         "lambda_param",
         "sigma",
         "verbose",
+        "basis_cache_dir",
+        "search_arity",
+        "torch_noise",
     ]
 
     _estimator_requirements = (BaseEstimator, ClassifierMixin)
@@ -74,12 +79,16 @@ class GeoDA(EvasionAttack):
         lambda_param: float = 0.6,
         sigma: float = 0.0002,
         verbose: bool = True,
+        basis_cache_dir: str | None = None,
+        search_arity: int = 2,
+        torch_noise: bool = False,
     ) -> None:
         """
         Create a Geometric Decision-based Attack instance.
 
         :param estimator: A trained classifier.
-        :param batch_size: The size of the batch used by the estimator during inference.
+        :param batch_size: The size of the batch used by the estimator during inference. All images of `x` are attacked
+                           concurrently, the queries of all images are batched together.
         :param norm: The norm of the adversarial perturbation. Possible values: "inf", np.inf, 1 or 2.
         :param sub_dim: Dimensionality of 2D frequency space (DCT).
         :param max_iter: Maximum number of iterations.
@@ -91,6 +100,15 @@ class GeoDA(EvasionAttack):
         :param sigma: Variance of the Gaussian perturbation.
         :param targeted: Should the attack target one specific class.
         :param verbose: Show progress bars.
+        :param basis_cache_dir: Directory of the DCT basis cache. If given, the basis is stored under a hash of its
+                                parameters and loaded on repeat runs. The basis is kept in memory for the lifetime of
+                                the process either way.
+        :param search_arity: Number of points `k - 1` the boundary searches evaluate per estimator call. The binary
+                             search narrows the interval by a factor of `k` per call, the walk towards the boundary
+                             takes `k - 1` steps per call. `search_arity=2` is the sequential search.
+        :param torch_noise: Generate the sub-space noise of the gradient estimation with torch on the device of the
+                            estimator, by a separable inverse DCT of the low frequency coefficients instead of the
+                            dense basis matrix. Requires a PyTorch estimator.
         """
         super().__init__(estimator=estimator)
 
@@ -102,6 +120,9 @@ class GeoDA(EvasionAttack):
         self.lambda_param = lambda_param
         self.sigma = sigma
         self._targeted = False
+        self.basis_cache_dir = basis_cache_dir
+        self.search_arity = search_arity
+        self.torch_noise = torch_noise
 
         self.verbose = verbose
         self._check_params()
@@ -123,43 +144,59 @@ class GeoDA(EvasionAttack):
         q_opt_it = int(self.max_iter - iterate * 25)
         self.q_opt_iter, self.iterate = self._opt_query_iteration(q_opt_it, iteration, self.lambda_param)
 
+    # DCT bases of this process, keyed like the files of the basis cache
+    _dct_basis_memo: dict[str, np.ndarray] = {}
+
+    @staticmethod
+    def _generate_1d_dct_basis(sub_dim: int, res: int) -> np.ndarray:
+        """
+        Generate the 1D DCT vectors of the `sub_dim` lowest frequencies.
+
+        :return: Array of shape (sub_dim, res) with `dct_1d[i_u, i_x] = alpha(i_u) * cos((2 * i_x + 1) * i_u * pi /
+                 (2 * num))`.
+        """
+        num = max(res, sub_dim)
+        freq = np.arange(sub_dim)
+        alpha = np.where(freq == 0, math.sqrt(1.0 / num), math.sqrt(2.0 / num))
+        return alpha[:, None] * np.cos(np.outer(freq, 2 * np.arange(res) + 1) * math.pi / (2 * num))
+
     @staticmethod
     def _generate_2d_dct_basis(sub_dim: int, res: int) -> np.ndarray:
-        def alpha(var_a: int, num: int):
-            """
-            Get alpha.
-            """
-            if var_a == 0:
-                return math.sqrt(1.0 / num)
-
-            return math.sqrt(2.0 / num)
-
-        def dct(i_x: int, i_y: int, i_v: int, i_u: int, num: int) -> float:
-            """
-            Get 2D DCT.
-            """
-            return (
-                alpha(i_u, num)
-                * alpha(i_v, num)
-                * math.cos(((2 * i_x + 1) * (i_u * math.pi)) / (2 * num))
-                * math.cos(((2 * i_y + 1) * (i_v * math.pi)) / (2 * num))
-            )
+        """
+        Generate the 2D DCT basis of the `sub_dim` x `sub_dim` lowest frequencies as outer products of 1D DCT vectors.
 
-        # We can get different frequencies by setting u and v
-        u_max = sub_dim
-        v_max = sub_dim
+        :return: The basis of shape (res * res, sub_dim * sub_dim), column `i_u * sub_dim + i_v` is the basis image of
+                 frequencies (i_u, i_v) with `i_u` varying along x and `i_v` along y.
+        """
+        dct_1d = GeoDA._generate_1d_dct_basis(sub_dim, res)
+        dct_basis = np.einsum("ux,vy->uvyx", dct_1d, dct_1d)
 
-        dct_basis = []
-        for i_u in range(u_max):
-            for i_v in range(v_max):
-                basis = np.zeros((res, res))
-                for i_y in range(res):
-                    for i_x in range(res):
-                        basis[i_y, i_x] = dct(i_x, i_y, i_v, i_u, max(res, v_max))
-                dct_basis.append(basis)
-        dct_basis_array = np.asmatrix(np.reshape(dct_basis, (v_max * u_max, res * res))).transpose()
+        return dct_basis.reshape(sub_dim * sub_dim, res * res).transpose()
 
-        return dct_basis_array
+    def _load_2d_dct_basis(self, res: int) -> np.ndarray:
+        """
+        Get the DCT basis from memory, the basis cache or generate it.
+        """
+        key = hashlib.sha1(json.dumps(["2d_dct_basis", self.sub_dim, res]).encode()).hexdigest()[:16]
+        if key in self._dct_basis_memo:
+            return self._dct_basis_memo[key]
+
+        path = None
+        if self.basis_cache_dir is not None:
+            path = os.path.join(self.basis_cache_dir, f"2d_dct_basis_{self.sub_dim}_{res}_{key}.npy")
+        if path is not None and os.path.exists(path):
+            basis = np.load(path)
+        else:
+            basis = self._generate_2d_dct_basis(sub_dim=self.sub_dim, res=res)
+            if path is not None:
+                os.makedirs(self.basis_cache_dir, exist_ok=True)
+                # write to a temporary file and rename, so concurrent runs never load a half written basis
+                tmp_path = f"{path}.{os.getpid()}.tmp.npy"
+                np.save(tmp_path, basis)
+                os.replace(tmp_path, path)
+
+        self._dct_basis_memo[key] = basis
+        return basis
 
     def generate(self, x: np.ndarray, y: np.ndarray | None = None, **kwargs) -> np.ndarray:
         """
@@ -203,76 +240,83 @@ class GeoDA(EvasionAttack):
         # Create or load DCT basis
         image_size = x.shape[2]
         logger.info("Create or load DCT basis.")
-        path = f"data/2d_dct_basis_{self.sub_dim}_{image_size}.npy"
-        if os.path.exists(path):
-            self.sub_basis = np.load(path).astype(ART_NUMPY_DTYPE)
-        else:
-            self.sub_basis = self._generate_2d_dct_basis(sub_dim=self.sub_dim, res=image_size).astype(ART_NUMPY_DTYPE)
-            np.save(path, self.sub_basis)
-
-        for i in trange(x.shape[0], desc="GeoDA - samples", disable=not self.verbose, position=0):
-            x_i = x[[i]]
-            y_i = y[[i]]
+        if self.torch_noise:
+            import torch
 
-            # Reset number of calls
-            self.nb_calls = 0
+            self.sub_basis_1d = torch.as_tensor(
+                self._generate_1d_dct_basis(self.sub_dim, image_size), dtype=torch.float32, device=self.estimator.device
+            )
+        else:
+            self.sub_basis = self._load_2d_dct_basis(image_size).astype(ART_NUMPY_DTYPE)
 
-            # Random search
-            x_random = self._find_random_adversarial(x=x_i, y=y_i)
-            logger.info("Random search adversarial example is adversarial: %r", self._is_adversarial(x_random, y_i))
+        # All images are attacked concurrently, every step queries the estimator for the pending images together
+        self.nb_calls = np.zeros(x.shape[0], dtype=int)
 
-            # Binary search
-            x_boundary = self._binary_search(x_i, y_i, x_random, tol=self.bin_search_tol)
-            logger.info("Binary search example at boundary is adversarial: %r", self._is_adversarial(x_boundary, y_i))
+        # Random search
+        x_random = self._find_random_adversarial(x=x, y=y)
+        logger.info("Random search adversarial examples are adversarial: %r", self._is_adversarial(x_random, y))
 
-            grad = np.zeros_like(x_i)
-            x_adv_i = x_i
+        # Binary search
+        x_boundary = self._binary_search(x, y, x_random, tol=self.bin_search_tol)
+        logger.info("Binary search examples at boundary are adversarial: %r", self._is_adversarial(x_boundary, y))
 
-            for k in trange(self.iterate, desc="GeoDA - steps", disable=not self.verbose, position=1):
-                grad_oi, _ = self._black_grad_batch(x_boundary, self.q_opt_iter[k], self.batch_size, y_i)
-                grad = grad_oi + grad
-                x_adv_i = self._go_to_boundary(x_i, y_i, grad)
-                x_adv_i = self._binary_search(x_i, y_i, x_adv_i, tol=self.bin_search_tol)
-                x_boundary = x_adv_i
+        grad = np.zeros_like(x)
 
-            x_adv_i = np.clip(x_adv_i, a_min=self.clip_min, a_max=self.clip_max)
+        for k in trange(self.iterate, desc="GeoDA - steps", disable=not self.verbose, position=0):
+            grad_oi, _ = self._black_grad_batch(x_boundary, self.q_opt_iter[k], self.batch_size, y)
+            grad = grad_oi + grad
+            x_adv = self._go_to_boundary(x, y, grad)
+            x_adv = self._binary_search(x, y, x_adv, tol=self.bin_search_tol)
+            x_boundary = x_adv
 
-            x_adv[i] = x_adv_i
+        x_adv = np.clip(x_adv, a_min=self.clip_min, a_max=self.clip_max)
 
         return x_adv
 
-    def _is_adversarial(self, x_adv: np.ndarray, y_true: np.ndarray) -> bool:
+    def _is_adversarial(self, x_adv: np.ndarray, y_true: np.ndarray) -> np.ndarray:
         """
-        Check if example is adversarial.
+        Check if examples are adversarial.
 
-        :param x_adv: Current example.
-        :param y_true: True label of `x`.
-        :return: Boolean if `x` is mis-classified.
+        :param x_adv: Current examples.
+        :param y_true: True labels of `x`.
+        :return: Boolean array, true for the mis-classified examples.
         """
-        y_prediction = self.estimator.predict(x=x_adv)
+        y_prediction = self.estimator.predict(x=x_adv, batch_size=self.batch_size)
 
         if self.targeted:
-            return np.argmax(y_prediction, axis=1)[0] == np.argmax(y_true, axis=1)[0]
+            return np.argmax(y_prediction, axis=1) == np.argmax(y_true, axis=1)
 
-        return np.argmax(y_prediction, axis=1)[0] != np.argmax(y_true, axis=1)[0]
+        return np.argmax(y_prediction, axis=1) != np.argmax(y_true, axis=1)
+
+    @staticmethod
+    def _per_sample(values: np.ndarray, x: np.ndarray) -> np.ndarray:
+        """
+        Reshape per-sample values to broadcast against the examples `x`.
+        """
+        return values.reshape((-1,) + (1,) * (x.ndim - 1))
 
     def _find_random_adversarial(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
         """
-        Find an adversarial example by random search.
+        Find adversarial examples by random search.
 
-        :param x: Current example.
-        :param y: True label of `x`.
-        :return: A random adversarial example for `x`.
+        :param x: Current examples.
+        :param y: True labels of `x`.
+        :return: Random adversarial examples for `x`.
         """
-        nb_calls = 0
+        nb_calls = np.zeros(x.shape[0], dtype=int)
         step_size = 0.02
-        x_perturbed = x
-
-        while not self._is_adversarial(x_perturbed, y):
-            nb_calls += 1
-            perturbation = np.random.normal(size=x.shape).astype(ART_NUMPY_DTYPE)
-            x_perturbed = x + nb_calls * step_size * perturbation
-            x_perturbed = np.clip(x_perturbed, a_min=self.clip_min, a_max=self.clip_max)
+        x_perturbed = x.copy()
+
+        pending = ~self._is_adversarial(x_perturbed, y)
+        while pending.any():
+            nb_calls[pending] += 1
+            perturbation = np.random.normal(size=x[pending].shape).astype(ART_NUMPY_DTYPE)
+            x_perturbed[pending] = np.clip(
+                x[pending] + self._per_sample(nb_calls[pending], x) * step_size * perturbation,
+                a_min=self.clip_min,
+                a_max=self.clip_max,
+            )
+            pending[pending] = ~self._is_adversarial(x_perturbed[pending], y[pending])
 
         self.nb_calls += nb_calls
 
@@ -280,28 +324,44 @@ class GeoDA(EvasionAttack):
 
     def _binary_search(self, x: np.ndarray, y: np.ndarray, x_random: np.ndarray, tol: float) -> np.ndarray:
         """
-        Find example on decision boundary between input and random sample by binary search.
+        Find examples on the decision boundary between inputs and random samples by binary search.
 
-        :param x: Current example.
-        :param y: True label of `x`.
-        :param x_random: Random adversarial example of `x`.
-        :return: The adversarial example at the decision boundary.
+        :param x: Current examples.
+        :param y: True labels of `x`.
+        :param x_random: Random adversarial examples of `x`.
+        :return: The adversarial examples at the decision boundary.
         """
-        x_adv = x_random
-        x_cln = x
+        x_adv = x_random.copy()
+        x_cln = x.copy()
 
         if self.estimator.clip_values is not None:
-            max_value = self.estimator.clip_values[1]
+            max_value = np.full(x.shape[0], self.estimator.clip_values[1])
         else:
-            max_value = np.max(x)
-
-        while np.linalg.norm((x_adv.flatten() - x_cln.flatten()) / max_value, ord=2) >= tol:
-            self.nb_calls += 1
-            x_mid = (x_cln + x_adv) / 2.0
-            if self._is_adversarial(x_mid, y):
-                x_adv = x_mid
-            else:
-                x_cln = x_mid
+            max_value = np.max(x.reshape(x.shape[0], -1), axis=1)
+
+        def distance(idx: np.ndarray) -> np.ndarray:
+            diff = (x_adv[idx] - x_cln[idx]).reshape(len(idx), -1) / max_value[idx, None]
+            return np.linalg.norm(diff, ord=2, axis=1)
+
+        # k - 1 points split the interval into k parts, one estimator call scores the points of all pending examples
+        arity = self.search_arity
+        frac = self._per_sample(np.arange(arity + 1) / arity, x)[None].astype(x.dtype)
+
+        pending = distance(np.arange(x.shape[0])) >= tol
+        while pending.any():
+            idx = np.flatnonzero(pending)
+            self.nb_calls[idx] += arity - 1
+            # points[:, 0] is x_cln and points[:, arity] is x_adv
+            points = (1 - frac) * x_cln[idx][:, None] + frac * x_adv[idx][:, None]
+            points[:, 0], points[:, arity] = x_cln[idx], x_adv[idx]
+            is_adversarial = self._is_adversarial(
+                points[:, 1:arity].reshape((-1,) + x.shape[1:]), np.repeat(y[idx], arity - 1, axis=0)
+            ).reshape(len(idx), arity - 1)
+            # the first adversarial point closes the new interval, x_adv if there is none
+            first = np.argmax(np.concatenate([is_adversarial, np.ones((len(idx), 1), dtype=bool)], axis=1), axis=1)
+            x_adv[idx] = points[np.arange(len(idx)), first + 1]
+            x_cln[idx] = points[np.arange(len(idx)), first]
+            pending[idx] = distance(idx) >= tol
 
         return x_adv
 
@@ -324,72 +384,143 @@ class GeoDA(EvasionAttack):
 
     def _black_grad_batch(
         self, x_boundary: np.ndarray, q_max: int, batch_size: int, original_label: np.ndarray
-    ) -> tuple[np.ndarray, int]:
+    ) -> tuple[np.ndarray, np.ndarray]:
         """
-        Calculate gradient towards decision boundary.
+        Calculate gradients towards the decision boundary, `q_max` queries per example. The queries of all examples
+        are flattened and sent to the estimator in batches of `batch_size`.
         """
         self.nb_calls += q_max
-        grad_tmp: list[np.ndarray] = []  # estimated gradients in each estimate_batch
-        z_list: list[int] = []  # sign of grad_tmp
-        outs = []
-        num_batches = math.ceil(q_max / batch_size)
-        last_batch = q_max - (num_batches - 1) * batch_size
-        all_noises = []
-
-        for j in range(num_batches):
-            if j == num_batches - 1:
-                current_batch = self._sub_noise(last_batch, self.sub_basis)
-                noisy_boundary = [x_boundary[0, :, :, :]] * last_batch + self.sigma * current_batch
-            else:
-                current_batch = self._sub_noise(batch_size, self.sub_basis)
-                noisy_boundary = [x_boundary[0, :, :, :]] * batch_size + self.sigma * current_batch
-
-            all_noises.append(current_batch)
-            predict_labels = np.argmax(self.estimator.predict(noisy_boundary), axis=1).astype(int)
-            outs.append(predict_labels)
-
-        all_noise = np.concatenate(all_noises, axis=0)
-        outs = np.concatenate(outs, axis=0)
-
-        for i, predict_label in enumerate(outs):
-            if predict_label == np.argmax(original_label, axis=1)[0]:
-                z_list.append(1)
-                grad_tmp.append(all_noise[i])
-            else:
-                z_list.append(-1)
-                grad_tmp.append(-all_noise[i])
-
-        grad: np.ndarray = -(1 / q_max) * sum(grad_tmp)  # type: ignore
-        grad_f = grad[None, :, :, :]
-
-        return grad_f, sum(z_list)
+        nb_samples = x_boundary.shape[0]
+        nb_queries = nb_samples * q_max
+        labels = np.argmax(original_label, axis=1)
+        grad = np.zeros_like(x_boundary)
+        z_sum = np.zeros(nb_samples, dtype=int)  # sum of the signs of the estimated gradients
+
+        if self.torch_noise:
+            return self._black_grad_batch_torch(x_boundary, q_max, batch_size, labels)
+
+        for start in range(0, nb_queries, batch_size):
+            # example of every query in the batch, queries of the same example are consecutive
+            idx = np.arange(start, min(start + batch_size, nb_queries)) // q_max
+            current_batch = self._sub_noise(len(idx), self.sub_basis)
+            noisy_boundary = x_boundary[idx] + self.sigma * current_batch
+            predict_labels = np.argmax(self.estimator.predict(noisy_boundary, batch_size=batch_size), axis=1)
+
+            z_list = np.where(predict_labels == labels[idx], 1, -1)
+            samples, first = np.unique(idx, return_index=True)
+            grad[samples] += np.add.reduceat(self._per_sample(z_list, current_batch) * current_batch, first, axis=0)
+            z_sum[samples] += np.add.reduceat(z_list, first)
+
+        grad_f = -(1 / q_max) * grad
+
+        return grad_f, z_sum
+
+    def _black_grad_batch_torch(
+        self, x_boundary: np.ndarray, q_max: int, batch_size: int, labels: np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        `_black_grad_batch` with the noise generated, added to the boundary points and accumulated on the device of the
+        estimator. Only the queries are copied to the host for `estimator.predict`.
+        """
+        import torch
+
+        device = self.estimator.device
+        nb_samples = x_boundary.shape[0]
+        nb_queries = nb_samples * q_max
+        boundary = torch.as_tensor(x_boundary, device=device)
+        labels_t = torch.as_tensor(labels, device=device)
+        grad = torch.zeros_like(boundary)
+        z_sum = torch.zeros(nb_samples, dtype=torch.long, device=device)
+
+        for start in range(0, nb_queries, batch_size):
+            # example of every query in the batch, queries of the same example are consecutive
+            idx = torch.arange(start, min(start + batch_size, nb_queries), device=device) // q_max
+            current_batch = self._sub_noise_torch(len(idx)).to(boundary.dtype)
+            noisy_boundary = boundary[idx] + self.sigma * current_batch
+            predict_labels = np.argmax(
+                self.estimator.predict(noisy_boundary.cpu().numpy(), batch_size=batch_size), axis=1
+            )
+
+            z_list = torch.where(torch.as_tensor(predict_labels, device=device) == labels_t[idx], 1, -1)
+            grad.index_add_(0, idx, z_list.view((-1,) + (1,) * (current_batch.dim() - 1)) * current_batch)
+            z_sum.index_add_(0, idx, z_list)
+
+        grad_f = -(1 / q_max) * grad
+
+        return grad_f.cpu().numpy(), z_sum.cpu().numpy()
+
+    def _sub_noise_torch(self, num_noises: int):
+        """
+        Create subspace random perturbations on the device of the estimator. The random DCT coefficients of the
+        `sub_dim` x `sub_dim` lowest frequencies are transformed with a separable inverse DCT, which equals the product
+        with the 2D basis of `_sub_noise`.
+
+        :param num_noises: Number of random subspace noises.
+        :return: Random subspace perturbations as torch tensor.
+        """
+        import torch
+
+        dct_1d = self.sub_basis_1d
+        noise = torch.randn(
+            (num_noises, self.nb_channels, self.sub_dim, self.sub_dim), device=dct_1d.device, dtype=dct_1d.dtype
+        ) * (self.clip_max - self.clip_min)
+        # r[y, x] = sum_{u, v} noise[u, v] * dct_1d[u, x] * dct_1d[v, y]
+        r_list = dct_1d.transpose(0, 1) @ noise.transpose(-1, -2) @ dct_1d
+
+        if not self.estimator.channels_first:
+            r_list = r_list.permute(0, 2, 3, 1)
+
+        return r_list
 
     def _go_to_boundary(self, x: np.ndarray, y: np.ndarray, grad: np.ndarray) -> np.ndarray:
         """
         Move towards decision boundary.
 
-        :param x: Current example to be moved towards the decision boundary.
-        :param y: The true label.
-        :param grad: Gradient towards decision boundary.
-        :return: Example moved towards decision boundary.
+        :param x: Current examples to be moved towards the decision boundary.
+        :param y: The true labels.
+        :param grad: Gradients towards decision boundary.
+        :return: Examples moved towards decision boundary.
         """
         epsilon = 5
-        nb_calls = 0
-        x_perturbed = x
+        max_steps = 100
+        arity = self.search_arity
+        nb_steps = np.zeros(x.shape[0], dtype=int)
+        nb_calls = np.zeros(x.shape[0], dtype=int)
+        x_perturbed = x.copy()
 
         if self.norm in [np.inf, "inf"]:
-            grads = np.sign(grad) / np.linalg.norm(grad.flatten(), ord=2)
+            grads = np.sign(grad) / self._per_sample(np.linalg.norm(grad.reshape(x.shape[0], -1), ord=2, axis=1), x)
         else:
             grads = grad  # self.norm in [1, 2]
 
-        while not self._is_adversarial(x_perturbed, y):
-            nb_calls += 1
-            if nb_calls > 100:
+        pending = ~self._is_adversarial(x_perturbed, y)
+        while pending.any():
+            failed = pending & (nb_steps >= max_steps)
+            if failed.any():
                 logger.info("Moving towards decision boundary failed because of too many iterations.")
-                break
+                pending &= ~failed
+                if not pending.any():
+                    break
+
+            # the next k - 1 steps of all pending examples are scored in one estimator call
+            idx = np.flatnonzero(pending)
+            steps = nb_steps[idx, None] + np.arange(1, arity)
+            valid = steps <= max_steps
+            nb_calls[idx] += valid.sum(axis=1)
+            points = np.clip(
+                x[idx][:, None] + (steps * epsilon).reshape(steps.shape + (1,) * (x.ndim - 1)).astype(x.dtype) * grads[idx][:, None],
+                a_min=self.clip_min,
+                a_max=self.clip_max,
+            )
+            is_adversarial = np.zeros(steps.shape, dtype=bool)
+            is_adversarial[valid] = self._is_adversarial(points[valid], np.repeat(y[idx], valid.sum(axis=1), axis=0))
 
-            x_perturbed = x + (nb_calls * epsilon * grads[0])
-            x_perturbed = np.clip(x_perturbed, a_min=self.clip_min, a_max=self.clip_max)
+            # the first adversarial step, the last valid step if there is none
+            hit = is_adversarial.any(axis=1)
+            last = np.where(hit, np.argmax(is_adversarial, axis=1), valid.sum(axis=1) - 1)
+            x_perturbed[idx] = points[np.arange(len(idx)), last]
+            nb_steps[idx] = steps[np.arange(len(idx)), last]
+            pending[idx[hit]] = False
 
         self.nb_calls += nb_calls
 
@@ -451,3 +582,15 @@ class GeoDA(EvasionAttack):
 
         if not isinstance(self.verbose, bool):
             raise ValueError("The argument `verbose` has to be of type bool.")
+
+        if not isinstance(self.torch_noise, bool):
+            raise ValueError("The argument `torch_noise` has to be of type bool.")
+
+        if self.torch_noise and not hasattr(self.estimator, "device"):
+            raise ValueError("The argument `torch_noise` requires a PyTorch estimator.")
+
+        if not isinstance(self.search_arity, int) or self.search_arity < 2:
+            raise ValueError("The search arity has to be an integer larger than 1.")
+
+        if self.basis_cache_dir is not None and not isinstance(self.basis_cache_dir, str):
+            raise ValueError("The basis cache directory has to be a string or None.")
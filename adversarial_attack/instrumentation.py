@@ -0,0 +1,129 @@
+"""
+Cost accounting of the attacks. The counters hook into the torch model all wrappers (ART, foolbox, plain torch) share,
+so every attack is measured the same way, white-box and black-box.
+"""
+from __future__ import annotations
+
+import time
+
+import torch
+
+
+def _sync(tensor: torch.Tensor) -> None:
+    # kernels run asynchronously on the GPU, the clock only stops when they are done
+    if tensor.is_cuda:
+        torch.cuda.synchronize(tensor.device)
+
+
+class _BackwardProbe(torch.autograd.Function):
+    """
+    Identity in the forward pass, calls `hook(grad)` when the gradient passes in the backward pass.
+    """
+
+    @staticmethod
+    def forward(ctx, x, hook):
+        ctx.hook = hook
+        return x.view_as(x)
+
+    @staticmethod
+    def backward(ctx, grad):
+        ctx.hook(grad)
+        return grad, None
+
+
+class ModelCounter:
+    """
+    Counts the forward and backward passes through a model, the images they process and the time they take.
+
+    - `forward_calls` / `forward_images`: calls of the model and images in these calls, predictions and gradient
+      computations alike.
+    - `backward_calls` / `backward_images`: backward passes through the model output, e.g. one per loss gradient.
+    - `forward_time` / `backward_time`: seconds spent in the model. The backward time runs from the output to the input
+      gradient and is only measured for gradients with respect to the input. Only measured with `timing`, `None`
+      otherwise.
+
+    The counters are forward hooks on the model and count until `detach` is called. Counting alone never waits for the
+    device. Timing synchronises the GPU before and after every forward and backward pass, which serialises the model
+    calls and slows the attacks down.
+    """
+
+    keys = ("forward_calls", "forward_images", "backward_calls", "backward_images", "forward_time", "backward_time")
+
+    def __init__(self, net: torch.nn.Module, timing: bool = False) -> None:
+        """
+        :param net: The torch model, the one the ART and foolbox wrappers of the attacks call.
+        :param timing: Also measure the time of the forward and backward passes.
+        """
+        self.net = net
+        self.timing = timing
+        self._handles: list = []
+        self._forward_start = 0.0
+        self._backward_start = 0.0
+        self.reset()
+
+    def attach(self) -> None:
+        """
+        Register the hooks, does nothing if they are registered already.
+        """
+        if not self._handles:
+            # ART runs sequential models layer by layer, the model itself is never called
+            first, last = (self.net[0], self.net[-1]) if isinstance(self.net, torch.nn.Sequential) else (self.net, self.net)
+            self._handles = [first.register_forward_pre_hook(self._pre_forward),
+                             last.register_forward_hook(self._post_forward)]
+
+    def detach(self) -> None:
+        """
+        Remove the hooks, the counters keep their values.
+        """
+        for handle in self._handles:
+            handle.remove()
+        self._handles = []
+
+    def reset(self) -> None:
+        for key in self.keys:
+            if key.endswith("_time"):
+                setattr(self, key, 0.0 if self.timing else None)
+            else:
+                setattr(self, key, 0)
+
+    def snapshot(self) -> dict:
+        """
+        :return: The counters as dict.
+        """
+        return {key: getattr(self, key) for key in self.keys}
+
+    def _pre_forward(self, module, args):
+        x = args[0]
+        self.forward_calls += 1
+        self.forward_images += x.shape[0]
+        if not self.timing:
+            return None
+        _sync(x)
+        self._forward_start = time.perf_counter()
+        if torch.is_grad_enabled() and x.requires_grad:
+            # the end of the backward pass, the gradient arrives at the input
+            return (_BackwardProbe.apply(x, self._input_grad),) + tuple(args[1:])
+        return None
+
+    def _post_forward(self, module, args, output):
+        if not isinstance(output, torch.Tensor):
+            if self.timing:
+                self.forward_time += time.perf_counter() - self._forward_start
+            return None
+        if self.timing:
+            _sync(output)
+            self.forward_time += time.perf_counter() - self._forward_start
+        if torch.is_grad_enabled() and output.requires_grad:
+            return _BackwardProbe.apply(output, self._output_grad)
+        return None
+
+    def _output_grad(self, grad: torch.Tensor) -> None:
+        self.backward_calls += 1
+        self.backward_images += grad.shape[0]
+        if self.timing:
+            _sync(grad)
+            self._backward_start = time.perf_counter()
+
+    def _input_grad(self, grad: torch.Tensor) -> None:
+        _sync(grad)
+        self.backward_time += time.perf_counter() - self._backward_start
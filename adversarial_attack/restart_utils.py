@@ -0,0 +1,19 @@
+"""
+Helpers for restarts that run concurrently as replicas of the batch, shared by the APGD and sparse-RS attacks.
+"""
+import torch
+
+
+def replicate(x, n_rep):
+    """ n_rep copies of the batch x, concatenated along the batch axis """
+    return x.repeat(n_rep, *[1] * (x.dim() - 1))
+
+
+def first_replica(mask, n_rep):
+    """
+    :param mask:   boolean mask of replicated samples, n_rep blocks of the batch size
+    :return:       indices of the first replica per sample where mask holds (the
+                   first replica if it never holds) into the replicated batch
+    """
+    mask = mask.view(n_rep, -1)
+    return mask.float().argmax(0) * mask.shape[1] + torch.arange(mask.shape[1], device=mask.device)
@@ -20,6 +20,8 @@ import copy
 import sys
 import os
 
+from adversarial_attack.restart_utils import replicate, first_replica
+
 class Logger():
     def __init__(self, log_path):
         self.log_path = log_path
@@ -56,6 +58,9 @@ class RSAttack():
     :param data_loader        loader to get new images for resampling
     :param update_loc_period  period in queries of updates of the location
                               for image-specific patches
+    :param parallel_restarts  number of restarts run concurrently, the images
+                              still to fool are replicated along the batch axis
+                              (not for universal attacks)
     """
     
     def __init__(
@@ -78,7 +83,8 @@ class RSAttack():
             init_patches='random_squares',
             resample_loc=None,
             data_loader=None,
-            update_loc_period=None):
+            update_loc_period=None,
+            parallel_restarts=1):
         """
         Sparse-RS implementation in PyTorch
         """
@@ -102,6 +108,7 @@ class RSAttack():
         self.resample_loc = n_queries // 10 if resample_loc is None else resample_loc
         self.data_loader = data_loader
         self.update_loc_period = update_loc_period if not update_loc_period is None else 4 if not targeted else 10
+        self.parallel_restarts = parallel_restarts
         
     
     def margin_and_loss(self, x, y):
@@ -273,6 +280,75 @@ class RSAttack():
         
         return patch_univ.clamp(0., 1.)
     
+    def gather_pixels(self, x, ind):
+        """ colours of the pixels ind (flat indices h * w, one row per image), shape [n, c, n_ind] """
+        ind = ind.unsqueeze(1).expand(-1, x.shape[1], -1)
+        return x.reshape(x.shape[0], x.shape[1], -1).gather(2, ind)
+
+    def scatter_pixels(self, x, ind, clr):
+        """ in-place counterpart of gather_pixels, x has to be contiguous """
+        ind = ind.unsqueeze(1).expand(-1, x.shape[1], -1)
+        x.view(x.shape[0], x.shape[1], -1).scatter_(2, ind, clr)
+
+    def l1_pixels(self, x_adv, x, ind):
+        """ L1 distance of the pixels ind between x_adv and x per image, accumulated in float64 """
+        return (self.gather_pixels(x_adv, ind) - self.gather_pixels(x, ind)).abs().view(x.shape[0], -1).sum(-1, dtype=torch.float64)
+
+    def init_l0_l1(self, x):
+        """
+        eps random pixels per image get a random colour, images over the L1 budget stay clean. Also returns the L1
+        distance of the starting points, candidates update it from the pixels they touch only.
+        """
+        n, c, h, w = x.shape
+        ind_all = torch.rand([n, h * w], device=self.device).argsort(dim=1)
+        b_all, be_all = ind_all[:, :self.eps], ind_all[:, self.eps:]
+
+        x_best = x.clone(memory_format=torch.contiguous_format)
+        self.scatter_pixels(x_best, b_all, self.random_choice([n, c, self.eps]).clamp(0., 1.))
+        l1_best = self.l1_pixels(x_best, x, b_all)
+        over = l1_best > self.eps_L1
+        x_best[over] = x[over] #if over L1 budget, reject the change
+        l1_best[over] = 0.
+
+        return x_best, b_all, be_all, l1_best
+
+    def candidates_l0_l1(self, x_curr, x_best_curr, l1_curr, b_curr, be_curr, ind_p, ind_np):
+        """
+        new L0+L1 candidates for the whole batch: the perturbed pixels b_curr[:, ind_p] are reset to the clean image,
+        the unperturbed pixels be_curr[:, ind_np] get new random colours. Candidates over the L1 budget keep the
+        old colours of these pixels.
+
+        The L1 distance of the candidates is l1_curr, the distance of x_best_curr, updated with the 2 * eps_it
+        changed pixels instead of recomputed over the whole image.
+        """
+        n, c = x_curr.shape[:2]
+        p_set, np_set = b_curr[:, ind_p], be_curr[:, ind_np]
+
+        x_new = x_best_curr.clone(memory_format=torch.contiguous_format)
+        l1_reset = l1_curr - self.l1_pixels(x_new, x_curr, p_set)
+        self.scatter_pixels(x_new, p_set, self.gather_pixels(x_curr, p_set))
+        old_clr = self.gather_pixels(x_new, np_set)
+        if np_set.shape[1] > 1:
+            new_clr = self.random_choice([n, c, np_set.shape[1]]).clamp(0., 1.)
+        else:
+            # if update is 1x1 make sure the sampled color is different from the current one
+            new_clr = old_clr.clone()
+            resample = torch.ones(n, dtype=torch.bool, device=old_clr.device)
+            while resample.any():
+                new_clr[resample] = self.random_choice([int(resample.sum()), c, 1]).clamp(0., 1.)
+                resample = (new_clr == old_clr).view(n, -1).all(dim=1)
+        self.scatter_pixels(x_new, np_set, new_clr)
+
+        x_np = self.gather_pixels(x_curr, np_set)
+        l1_new = l1_reset + ((new_clr - x_np).abs() - (old_clr - x_np).abs()).view(n, -1).sum(-1, dtype=torch.float64)
+        over = l1_new > self.eps_L1
+        if over.any():
+            #if over L1 budget, reject the change
+            self.scatter_pixels(x_new, np_set, torch.where(over[:, None, None], old_clr, new_clr))
+            l1_new = torch.where(over, l1_reset, l1_new)
+
+        return x_new, l1_new
+
     def attack_single_run(self, x, y):
         with torch.no_grad():
             adv = x.clone()
@@ -283,20 +359,8 @@ class RSAttack():
             if self.norm == 'L0+L1':
                 eps = self.eps
                 
-                x_best = x.clone()
                 n_pixels = h * w
-                b_all, be_all = torch.zeros([x.shape[0], eps]).long().to(self.device), torch.zeros([x.shape[0], n_pixels - eps]).long().to(self.device)
-                for img in range(x.shape[0]):
-                    ind_all = torch.randperm(n_pixels)
-                    ind_p = ind_all[:eps]
-                    ind_np = ind_all[eps:]
-                    x_best[img, :, ind_p // w, ind_p % w] = self.random_choice([c, eps]).clamp(0., 1.)
-
-                    if torch.norm(x_best[img] - x[img], p=float(1)) > self.eps_L1:
-                        x_best[img] = x[img] #if over L1 budget, reject the change
-
-                    b_all[img] = ind_p.clone()
-                    be_all[img] = ind_np.clone()
+                x_best, b_all, be_all, l1_best = self.init_l0_l1(x)
                     
                 margin_min, loss_min = self.margin_and_loss(x_best, y)
                 n_queries = torch.ones(x.shape[0]).to(self.device)
@@ -321,29 +385,11 @@ class RSAttack():
                         idx_to_fool.unsqueeze_(0)
                     
                     # build new candidate
-                    x_new = x_best_curr.clone()
                     eps_it = max(int(self.p_selection(it) * eps), 1)
                     ind_p = torch.randperm(eps)[:eps_it]
                     ind_np = torch.randperm(n_pixels - eps)[:eps_it]
-                    
-                    for img in range(x_new.shape[0]):
-                        p_set = b_curr[img, ind_p]
-                        np_set = be_curr[img, ind_np]
-                        x_new[img, :, p_set // w, p_set % w] = x_curr[img, :, p_set // w, p_set % w].clone()
-                        x_new_img_clone = x_new[img].clone()
-                        if eps_it > 1:
-                            x_new[img, :, np_set // w, np_set % w] = self.random_choice([c, eps_it]).clamp(0., 1.)
-                        else:
-                            # if update is 1x1 make sure the sampled color is different from the current one
-                            old_clr = x_new[img, :, np_set // w, np_set % w].clone()
-                            assert old_clr.shape == (c, 1), print(old_clr)
-                            new_clr = old_clr.clone()
-                            while (new_clr == old_clr).all().item():
-                                new_clr = self.random_choice([c, 1]).clone().clamp(0., 1.)
-                            x_new[img, :, np_set // w, np_set % w] = new_clr.clone()
-
-                        if torch.norm(x_new[img] - x_curr[img], p=float(1)) > self.eps_L1:
-                            x_new[img] = x_new_img_clone #if over L1 budget, reject the change
+                    x_new, l1_new = self.candidates_l0_l1(x_curr, x_best_curr, l1_best[idx_to_fool], b_curr, be_curr,
+                                                          ind_p, ind_np)
                         
                     # compute loss of the new candidates
                     margin, loss = self.margin_and_loss(x_new, y_curr)
@@ -361,6 +407,7 @@ class RSAttack():
                         idx_improved = (idx_improved.view(-1) > 0).nonzero().squeeze()
                         margin_min[idx_to_fool[idx_improved]] = margin[idx_improved].clone()
                         x_best[idx_to_fool[idx_improved]] = x_new[idx_improved].clone()
+                        l1_best[idx_to_fool[idx_improved]] = l1_new[idx_improved]
                         t = b_curr[idx_improved].clone()
                         te = be_curr[idx_improved].clone()
                         
@@ -1052,14 +1099,18 @@ class RSAttack():
         torch.random.manual_seed(self.seed)
         torch.cuda.random.manual_seed(self.seed)
         np.random.seed(self.seed)
-        
-        for counter in range(self.n_restarts):
+
+        # universal attacks share the perturbation over the batch, replicas would change the attack
+        n_parallel = 1 if 'universal' in self.norm else max(self.parallel_restarts, 1)
+        for counter in range(0, self.n_restarts, n_parallel):
             ind_to_fool = acc.nonzero().squeeze()
             if len(ind_to_fool.shape) == 0:
                 ind_to_fool = ind_to_fool.unsqueeze(0)
             if ind_to_fool.numel() != 0:
-                x_to_fool = x[ind_to_fool].clone()
-                y_to_fool = y[ind_to_fool].clone()
+                # replicas of the restarts run together, every replica draws its own random numbers
+                n_rep = min(n_parallel, self.n_restarts - counter)
+                x_to_fool = replicate(x[ind_to_fool], n_rep)
+                y_to_fool = replicate(y[ind_to_fool], n_rep)
 
                 qr_curr, adv_curr = self.attack_single_run(x_to_fool, y_to_fool)
 
@@ -1068,6 +1119,10 @@ class RSAttack():
                     acc_curr = output_curr.max(1)[1] == y_to_fool
                 else:
                     acc_curr = output_curr.max(1)[1] != y_to_fool
+                if n_rep > 1:
+                    # first successful replica per image, the one sequential restarts would have returned
+                    ind_rep = first_replica(acc_curr == 0, n_rep)
+                    acc_curr, adv_curr, qr_curr = acc_curr[ind_rep], adv_curr[ind_rep], qr_curr[ind_rep]
                 ind_curr = (acc_curr == 0).nonzero().squeeze()
 
                 acc[ind_to_fool[ind_curr]] = 0
@@ -1075,7 +1130,7 @@ class RSAttack():
                 qr[ind_to_fool[ind_curr]] = qr_curr[ind_curr].clone()
                 if self.verbose:
                     print('restart {} - robust accuracy: {:.2%}'.format(
-                        counter, acc.float().mean()),
+                        counter + n_rep - 1, acc.float().mean()),
                         '- cum. time: {:.1f} s'.format(
                         time.time() - startt))
 
@@ -1,21 +1,22 @@
 import argparse
 import utils
 import adversarial_attack.attack_utils as attack_utils
+from adversarial_attack.dtype_policy import DtypePolicy
 import json
 import torch
 
 def main(dataset, samplesize_accuracy, samplesize_attack, dataset_root, model, model_norm, hyperparameter, hyperparameter_range, 
-         attack_type, epsilon_l1, epsilon_l2, eps_iter, norm, max_iterations, batchsize, save_images, verbose):
+         attack_type, epsilon_l1, epsilon_l2, eps_iter, norm, max_iterations, batchsize, save_images, verbose, journal_dir=None, dataset_cache=None, stream=False, accuracy_cache=None, model_precision='fp32', channels_last=False, attack_dtype='float32', telemetry=False):
     device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 
     # Load dataset
-    xtest, ytest = utils.load_dataset(dataset=dataset, dataset_split=samplesize_accuracy, root=dataset_root)
+    xtest, ytest = utils.load_dataset(dataset=dataset, dataset_split=samplesize_accuracy, root=dataset_root, cache_dir=dataset_cache, stream=stream)
 
     # Load model
-    net, art_net, fb_net, alias = utils.get_model(dataset=dataset, modelname=model, norm=model_norm)
+    net, art_net, fb_net, alias = utils.get_model(dataset=dataset, modelname=model, norm=model_norm, precision=model_precision, channels_last=channels_last)
 
     # calculate accuracy, select a subset from the correctly classified images
-    correct_map = utils.test_accuracy(net, xtest, ytest)
+    correct_map = utils.test_accuracy(net, xtest, ytest, cache_dir=accuracy_cache, cache_key=f'{alias}_{samplesize_accuracy}')
     xtest, ytest = utils.subset(correct_map, xtest, ytest, attack_samples=samplesize_attack)
 
     # Experiment setup
@@ -28,7 +29,10 @@ def main(dataset, samplesize_accuracy, samplesize_attack, dataset_root, model, m
         max_iterations=max_iterations,
         batchsize=batchsize,
         save_images=save_images,
-        verbose=verbose
+        verbose=verbose,
+        journal_dir=journal_dir,
+        dtype_policy=DtypePolicy(compute=attack_dtype, storage=attack_dtype),
+        telemetry=telemetry
     )
 
     # Hyperparameter sweep
@@ -51,10 +55,18 @@ if __name__ == "__main__":
     parser.add_argument('--samplesize_accuracy', type=int, default=10000, help="Split size for test accuracy evaluation")
     parser.add_argument('--samplesize_attack', type=int, default=500, help="Split size for attack evaluation")
     parser.add_argument('--dataset_root', type=str, default='../data', help="data folder relative root")
+    parser.add_argument('--stream', action='store_true', help="Stream the dataset in batches instead of loading it into memory")
+    parser.add_argument('--accuracy_cache', type=str, default=None, help="Directory of the cache of clean correctness maps and logits")
+    parser.add_argument('--dataset_cache', type=str, default=None, help="Directory of the memory-mapped cache of the preprocessed dataset")
     parser.add_argument('--model', type=str, default='Salman2020Do_R50',
                         help="Model name (e.g., standard, MainiAVG, etc.)")
     parser.add_argument('--model_norm', type=str, default='Linf',
                         help="Attack Norm the selected model was trained with. Only necessary if you load robustbench models")
+    parser.add_argument('--model_precision', type=str, default='fp32', choices=['fp32', 'fp16', 'bf16', 'fp64'],
+                        help="Precision of the model forward passes, fp16/bf16 run under autocast")
+    parser.add_argument('--channels_last', action='store_true', help="Run the model in channels_last memory layout")
+    parser.add_argument('--attack_dtype', type=str, default='float32', choices=['float32', 'float64'],
+                        help="Dtype the exp attacks compute in, precision-sensitive reductions always accumulate in float64")
     parser.add_argument('--hyperparameter', type=str, default='learning_rate', help="Hyperparameter to sweep")
     parser.add_argument('--hyperparameter_range', type=float, nargs='+', default=[1.5],
                         help="Range of hyperparameter values (space-separated)")
@@ -68,11 +80,14 @@ if __name__ == "__main__":
     parser.add_argument('--max_iterations', type=int, default=300, help="Maximum iterations for attacks")
     parser.add_argument('--batchsize', type=int, default=1, help="Batchsize to run every adversarial attack on")
     parser.add_argument('--save_images', type=int, default=1, help="Integer > 0: number of saved images per attack, 0: do not save)")
+    parser.add_argument('--telemetry', action='store_true', help="Also time the model calls of the attacks, synchronises the GPU around every call")
+    parser.add_argument('--journal_dir', type=str, default=None, help="Directory for journals of finished samples, an interrupted run resumes from them")
     parser.add_argument('--verbose', type=bool, default=False, help="Verbose output")
 
     args = parser.parse_args()
     main(
         args.dataset, args.samplesize_accuracy, args.samplesize_attack, args.dataset_root, args.model, args.model_norm, args.hyperparameter, 
         args.hyperparameter_range,  args.attack_type, args.epsilon_l1, args.epsilon_l2, args.eps_iter, args.attack_norm, args.max_iterations, 
-        args.batchsize, args.save_images, args.verbose
+        args.batchsize, args.save_images, args.verbose, args.journal_dir, args.dataset_cache, args.stream, args.accuracy_cache,
+        args.model_precision, args.channels_last, args.attack_dtype, args.telemetry
     )
\ No newline at end of file
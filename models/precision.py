@@ -0,0 +1,77 @@
+import torch
+import torch.nn as nn
+
+PRECISIONS = {'fp32': torch.float32, 'fp64': torch.float64, 'fp16': torch.float16, 'bf16': torch.bfloat16}
+
+
+class _ScaleGrad(torch.autograd.Function):
+    '''
+    Identity in the forward pass, multiplies the gradient by a constant in the backward pass.
+    '''
+    @staticmethod
+    def forward(ctx, x, scale):
+        ctx.scale = scale
+        return x.view_as(x)
+
+    @staticmethod
+    def backward(ctx, grad):
+        return grad * ctx.scale, None
+
+
+class PrecisionWrapper(nn.Module):
+    '''
+    Runs a model in reduced precision and/or channels_last memory layout, while inputs and logits keep the dtype the
+    attacks work with.
+
+    fp16 / bf16: the forward pass runs under torch.autocast, the weights stay in float32. Input gradients take the
+        mixed-precision path: autograd runs through the autocast graph and the gradient arrives in the dtype of the
+        input. For fp16 the gradient inside the network is scaled by grad_scale so that small input gradients do not
+        underflow, and unscaled again at the input.
+    fp64: weights and activations in float64, the reference the reduced precisions are checked against.
+    channels_last: weights and 4D inputs in NHWC layout, faster convolutions on tensor cores.
+
+    Forward passes without gradient tracking (torch.no_grad, as in the predictions of ART and foolbox) run under
+    torch.inference_mode.
+    '''
+    def __init__(self, net, precision='fp32', channels_last=False, grad_scale=2.0 ** 12):
+        super(PrecisionWrapper, self).__init__()
+        if precision not in PRECISIONS:
+            raise ValueError(f"Precision {precision} not supported, choose from {list(PRECISIONS)}.")
+        self.net = net
+        self.precision = precision
+        self.channels_last = channels_last
+        self.grad_scale = grad_scale if precision == 'fp16' else 1.0
+        self.autocast_dtype = PRECISIONS[precision] if precision in ['fp16', 'bf16'] else None
+        # dtype of the weights, inputs are cast to it
+        self.compute_dtype = torch.float64 if precision == 'fp64' else torch.float32
+
+        if precision == 'fp64':
+            self.net.double()
+        if channels_last:
+            self.net.to(memory_format=torch.channels_last)
+
+    def forward(self, x):
+        if not torch.is_grad_enabled():
+            with torch.inference_mode():
+                out = self._forward(x)
+            # a normal tensor, inference tensors cannot be modified in place outside of inference mode
+            return out.clone()
+        return self._forward(x)
+
+    def _forward(self, x):
+        out_dtype = x.dtype if x.is_floating_point() else self.compute_dtype
+        x = x.to(self.compute_dtype)
+        if self.channels_last and x.dim() == 4:
+            x = x.contiguous(memory_format=torch.channels_last)
+        if self.autocast_dtype is None:
+            return self.net(x).to(out_dtype)
+
+        scale = self.grad_scale != 1.0 and x.requires_grad
+        if scale:
+            x = _ScaleGrad.apply(x, 1.0 / self.grad_scale)
+        with torch.autocast(device_type=x.device.type, dtype=self.autocast_dtype):
+            out = self.net(x)
+        out = out.float()
+        if scale:
+            out = _ScaleGrad.apply(out, self.grad_scale)
+        return out.to(out_dtype)
@@ -11,6 +11,10 @@ cuda = True if torch.cuda.is_available() else False
 import torch
 import torchvision
 import torchvision.transforms as transforms
+import numpy as np
+import hashlib
+import json
+import os
 
 def load_dataset(dataset, dataset_split, root='../data'):
 
@@ -47,7 +51,27 @@ def load_dataset(dataset, dataset_split, root='../data'):
 
     return xtest, ytest
 
-def load_dataset(dataset, dataset_split, root='../data'):
+def load_dataset(dataset, dataset_split, root='../data', cache_dir=None, stream=False, batch_size=100, num_workers=4):
+    """
+    Loads the (truncated) test set as tensors.
+
+    Args:
+        dataset: 'imagenet' or 'cifar10'.
+        dataset_split: Number of randomly selected test samples, all samples if not an integer.
+        root: Data folder.
+        cache_dir: Directory of the preprocessed dataset cache. If given, the preprocessed images are stored once as
+            a .npy file per (dataset, transform, split, seed) and memory-mapped on later calls, so runs and worker
+            processes share the pages instead of decoding the images again. CIFAR10 is stored losslessly as uint8,
+            the resized ImageNet images as float16. The images are then returned in that dtype and converted per
+            batch (see as_float).
+        stream: Return a DataLoader over the test set instead of materializing it, memory is bounded by a few batches.
+        batch_size: Batch size of the DataLoader in streaming mode and while writing the cache.
+        num_workers: Number of DataLoader worker processes decoding the images.
+
+    Returns:
+        The images and labels of the test set, or the DataLoader and None in streaming mode.
+    """
+    seed = 42
 
     if dataset== 'imagenet':
 
@@ -57,29 +81,87 @@ def load_dataset(dataset, dataset_split, root='../data'):
         transforms.CenterCrop(224)
                                     ])
         
-        testset = datasets.ImageFolder(root=root+'/ImageNet/val', transform=transform)
-        
     elif dataset == 'cifar10':
 
         transform = transforms.Compose([
         transforms.ToTensor()])
-        
-        testset = datasets.CIFAR10(root=root+'/cifar', train=False, download=True, transform=transform)
 
     else: 
         raise KeyError("Dataset not implemented.")
+
+    if cache_dir is not None:
+        key = hashlib.sha1(json.dumps([dataset, repr(transform), dataset_split, seed]).encode()).hexdigest()[:16]
+        x_path = os.path.join(cache_dir, f'{dataset}_{key}_x.npy')
+        y_path = os.path.join(cache_dir, f'{dataset}_{key}_y.npy')
+        if os.path.exists(x_path) and os.path.exists(y_path):
+            return _open_cache(x_path, y_path, stream, batch_size)
+
+    if dataset == 'imagenet':
+        testset = datasets.ImageFolder(root=root+'/ImageNet/val', transform=transform)
+    else:
+        testset = datasets.CIFAR10(root=root+'/cifar', train=False, download=True, transform=transform)
     
     # Truncated testset for experiments and ablations
     if isinstance(dataset_split, int):
         testset, _ = torch.utils.data.random_split(testset,
                                                           [dataset_split, len(testset) - dataset_split],
-                                                          generator=torch.Generator().manual_seed(42))
+                                                          generator=torch.Generator().manual_seed(seed))
+
+    if cache_dir is not None:
+        # fill the cache batch by batch, the test set is never held in memory as a whole
+        os.makedirs(cache_dir, exist_ok=True)
+        # write to temporary files and rename, so concurrent runs never map a half written cache
+        x_tmp_path, y_tmp_path = f'{x_path}.{os.getpid()}.tmp', f'{y_path}.{os.getpid()}.tmp'
+        x_file, ytest, i = None, [], 0
+        for x, y in torch.utils.data.DataLoader(testset, batch_size=batch_size, num_workers=num_workers):
+            if dataset == 'cifar10':
+                # ToTensor produces multiples of 1/255, uint8 is exact
+                x = (x * 255).round().to(torch.uint8)
+            else:
+                x = x.to(torch.float16)
+            if x_file is None:
+                x_file = np.lib.format.open_memmap(x_tmp_path, mode='w+', dtype=x.numpy().dtype,
+                                                   shape=(len(testset), *x.shape[1:]))
+            x_file[i:i + len(x)] = x.numpy()
+            ytest.append(y)
+            i += len(x)
+        x_file.flush()
+        del x_file
+        with open(y_tmp_path, 'wb') as f:
+            np.save(f, torch.cat(ytest).numpy())
+        os.replace(x_tmp_path, x_path)
+        os.replace(y_tmp_path, y_path)
+        return _open_cache(x_path, y_path, stream, batch_size)
+
+    if stream:
+        return torch.utils.data.DataLoader(testset, batch_size=batch_size, num_workers=num_workers), None
     
     # Extract data and labels from torchvision dataset
     xtest, ytest = zip(*[(data[0], data[1]) for data in testset])
     return torch.stack(xtest), torch.tensor(ytest)
 
-def get_model(dataset, modelname, norm=None):
+def _open_cache(x_path, y_path, stream, batch_size):
+    # copy-on-write mapping: pages are shared between processes and never written back
+    xtest, ytest = torch.from_numpy(np.load(x_path, mmap_mode='c')), torch.from_numpy(np.load(y_path))
+    if stream:
+        return torch.utils.data.DataLoader(torch.utils.data.TensorDataset(xtest, ytest), batch_size=batch_size), None
+    return xtest, ytest
+
+def as_float(x):
+    """
+    Converts images from the dataset cache (uint8 or float16) to float32 in [0, 1], float32 images are returned as is.
+    """
+    if x.dtype == torch.uint8:
+        return x.float() / 255
+    return x.float()
+
+
+def get_model(dataset, modelname, norm=None, precision='fp32', channels_last=False):
+    '''
+    precision: 'fp32' (default), 'fp16' / 'bf16' (autocast forward passes, mixed-precision input gradients) or 'fp64'
+        (reference for the tolerance check in validation/precision_check.py)
+    channels_last: run the model in NHWC memory layout
+    '''
     
     if modelname=='CroceL1' and dataset=='cifar10': 
         '''
@@ -125,6 +207,10 @@ def get_model(dataset, modelname, norm=None):
     #net = torch.nn.DataParallel(net)
     net.eval()
 
+    if precision != 'fp32' or channels_last:
+        from models.precision import PrecisionWrapper
+        net = PrecisionWrapper(net, precision=precision, channels_last=channels_last)
+
     # Define loss function and optimizer
     criterion = nn.CrossEntropyLoss()
     optimizer = optim.Adam(net.parameters(), lr=0.01)
@@ -149,45 +235,88 @@ def get_model(dataset, modelname, norm=None):
     fb_net = fb.PyTorchModel(net, bounds=(0.0, 1.0), device=device)
 
     alias = modelname + '_' + dataset
+    if precision != 'fp32':
+        alias = alias + '_' + precision
 
     return net, art_net, fb_net, alias
 
-def test_accuracy(model, xtest, ytest, batch_size=100):
+def model_hash(model):
+    """
+    Hash of the parameters and buffers of a model, identifies the checkpoint it was loaded from.
+    """
+    digest = hashlib.sha1()
+    for name, tensor in sorted(model.state_dict().items()):
+        digest.update(name.encode())
+        digest.update(tensor.detach().cpu().contiguous().view(-1).view(torch.uint8).numpy().tobytes())
+    return digest.hexdigest()[:16]
+
+def test_accuracy(model, xtest, ytest, batch_size=100, cache_dir=None, cache_key=None, return_logits=False):
     """
     Tests the accuracy of the model and returns a tensor indicating whether each test sample
     was classified correctly or not.
 
     Args:
         model: The trained model to test.
-        xtest: Test dataset features (as a torch tensor).
-        ytest: True labels for the test dataset.
+        xtest: Test dataset features (as a torch tensor), or an iterable of (features, labels) batches such as the
+            DataLoader of load_dataset(stream=True).
+        ytest: True labels for the test dataset, None for a stream of batches.
         batch_size: Number of samples per batch for evaluation.
+        cache_dir: Directory of the correctness map cache. If given, the correctness map and the clean logits are
+            stored per (cache_key, model hash) and loaded on repeat runs without evaluating the model.
+        cache_key: Identifies the evaluated samples, e.g. model alias (contains the dataset) and split size.
+        return_logits: Also return the clean logits of all samples.
 
     Returns:
         A tensor of booleans where each element corresponds to whether the classification
-        of the respective test sample was correct or not.
+        of the respective test sample was correct or not, and the clean logits if return_logits is set.
     """
+    if cache_dir is not None:
+        assert cache_key is not None, "The correctness map cache needs a cache_key identifying the samples"
+        cache_path = os.path.join(cache_dir, f'{cache_key}_{model_hash(model)}_correct.pt')
+        if os.path.exists(cache_path):
+            cached = torch.load(cache_path)
+            correct_map, logits = cached['correct_map'], cached['logits']
+            accuracy = (correct_map.sum().item() / len(correct_map)) * 100
+            print(f'\nAccuracy of the test set is: {accuracy:.3f}% (cached)\n')
+            return (correct_map, logits) if return_logits else correct_map
+
     model.eval()
     correct_list = []  # To store correctness of each sample
+    keep_logits = return_logits or cache_dir is not None
+    logits_list = []
+
+    if torch.is_tensor(xtest):
+        batches = ((xtest[i:i + batch_size], ytest[i:i + batch_size]) for i in range(0, len(xtest), batch_size))
+    else:
+        batches = xtest
 
     with torch.no_grad():
-        for i in range(0, len(xtest), batch_size):
-            x_batch = xtest[i:i + batch_size].to(device)
-            y_batch = ytest[i:i + batch_size].to(device)
+        for x_batch, y_batch in batches:
+            x_batch = as_float(x_batch.to(device))
+            y_batch = y_batch.to(device)
             outputs = model(x_batch)
             _, predicted = torch.max(outputs, 1)
 
             # Append the boolean tensor correctness values
             correct_list.append((predicted == y_batch).cpu())
+            if keep_logits:
+                logits_list.append(outputs.float().cpu())
 
     # Concatenate all boolean tensors into a single tensor
     correct_map = torch.cat(correct_list)
+    logits = torch.cat(logits_list) if keep_logits else None
 
     # Calculate and print the overall accuracy
     accuracy = (correct_map.sum().item() / len(correct_map)) * 100
     print(f'\nAccuracy of the test set is: {accuracy:.3f}%\n')
 
-    return correct_map
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+        torch.save({'correct_map': correct_map, 'logits': logits}, tmp_path)
+        os.replace(tmp_path, cache_path)
+
+    return (correct_map, logits) if return_logits else correct_map
 
 def subset(correct_tensor, xtest, ytest, attack_samples=100):
     """
@@ -195,15 +324,19 @@ def subset(correct_tensor, xtest, ytest, attack_samples=100):
 
     Args:
         correct_tensor: Tensor of booleans indicating correctness of classification.
-        xtest: Test dataset features (as a torch tensor).
+        xtest: Test dataset features (as a torch tensor), or an iterable of (features, labels) batches.
         n: Number of samples to select.
 
     Returns:
-        A subset of xtest containing n correctly classified samples.
+        A subset of xtest containing n correctly classified samples. For a stream of batches, a CorrectSamples stream
+        that selects them on the fly, and None.
     """
     if attack_samples > correct_tensor.sum().item():
         raise ValueError("n cannot be greater than the number of correctly classified samples.")
 
+    if not torch.is_tensor(xtest):
+        return CorrectSamples(xtest, correct_tensor, attack_samples), None
+
     # Get indices of correctly classified samples
     correct_indices = torch.nonzero(correct_tensor, as_tuple=True)[0]
 
@@ -211,4 +344,34 @@ def subset(correct_tensor, xtest, ytest, attack_samples=100):
     selected_indices = correct_indices[:attack_samples]
 
     # Return the selected samples from xtest
-    return xtest[selected_indices], ytest[selected_indices]
+    return as_float(xtest[selected_indices]), ytest[selected_indices]
+
+class CorrectSamples:
+    """
+    Re-iterable stream of the first n correctly classified samples of a stream of batches. The samples are selected
+    batch by batch while the underlying stream is consumed, so only a few batches are held in memory.
+
+    Args:
+        batches: Re-iterable of (features, labels) batches, e.g. the DataLoader of load_dataset(stream=True).
+        correct_tensor: Tensor of booleans indicating correctness of classification, in stream order.
+        n: Number of samples to select.
+    """
+    def __init__(self, batches, correct_tensor, n):
+        self.batches = batches
+        self.correct_tensor = correct_tensor
+        self.n = n
+
+    def __len__(self):
+        return self.n
+
+    def __iter__(self):
+        i, selected = 0, 0
+        for x_batch, y_batch in self.batches:
+            keep = self.correct_tensor[i:i + len(x_batch)]
+            i += len(x_batch)
+            x_batch, y_batch = x_batch[keep][:self.n - selected], y_batch[keep][:self.n - selected]
+            selected += len(x_batch)
+            if len(x_batch) > 0:
+                yield as_float(x_batch), y_batch
+            if selected == self.n:
+                break
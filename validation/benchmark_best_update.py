@@ -0,0 +1,65 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from adversarial_attack.exp_attack_utils import update_best
+
+
+def loop_update(best_dist, best_label, best_attack, distance, label, x_adv, y):
+    # per-sample update as it was done in `_generate_bss` before
+    for j, (d, l) in enumerate(zip(distance, label)):
+        if d < best_dist[j] and l != y[j]:
+            best_dist[j] = d
+            best_attack[j] = x_adv[j]
+            best_label[j] = l
+
+
+def batched_update(best_dist, best_label, best_attack, distance, label, x_adv, y):
+    rows = np.arange(x_adv.shape[0])
+    update_best(best_dist, best_label, best_attack, rows, distance, label, x_adv, label != y)
+
+
+def benchmark(update, batch_size, shape, improve_rate, iterations, seed):
+    rng = np.random.default_rng(seed)
+    x_adv = rng.random((batch_size, *shape))
+    y = rng.integers(0, 10, batch_size)
+    best_dist = np.full(batch_size, np.inf)
+    best_label = np.full(batch_size, -np.inf)
+    best_attack = np.zeros_like(x_adv)
+
+    runtime = 0.0
+    for _ in range(iterations):
+        # random distances so that a fraction `improve_rate` of the samples improves in every iteration
+        improve = rng.random(batch_size) < improve_rate
+        distance = np.where(improve, 0.9, 1.1) * np.where(np.isinf(best_dist), 1.0, best_dist)
+        label = (y + 1) % 10
+        start = time.perf_counter()
+        update(best_dist, best_label, best_attack, distance, label, x_adv, y)
+        runtime += time.perf_counter() - start
+    return runtime / iterations
+
+
+def main(batch_sizes, shape, improve_rates, iterations, seed):
+    print(f'{"batch size":>10} {"improved":>9} {"loop [us]":>12} {"batched [us]":>14} {"speedup":>8}')
+    for improve_rate in improve_rates:
+        for batch_size in batch_sizes:
+            loop = benchmark(loop_update, batch_size, shape, improve_rate, iterations, seed)
+            batched = benchmark(batched_update, batch_size, shape, improve_rate, iterations, seed)
+            print(f'{batch_size:>10} {improve_rate:>9.2f} {loop * 1e6:>12.1f} {batched * 1e6:>14.1f} {loop / batched:>8.1f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Per-iteration overhead of the best-iterate update of the exp attacks.')
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=[1, 32, 256], help='Batch sizes to benchmark')
+    parser.add_argument('--shape', type=int, nargs='+', default=[3, 32, 32], help='Shape of a single input')
+    parser.add_argument('--improve_rates', type=float, nargs='+', default=[0.5, 0.05],
+                        help='Fractions of the samples that improve their best iterate in every iteration')
+    parser.add_argument('--iterations', type=int, default=200, help='Number of timed updates per batch size')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the random iterates')
+    args = parser.parse_args()
+
+    main(args.batch_sizes, tuple(args.shape), args.improve_rates, args.iterations, args.seed)
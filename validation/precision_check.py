@@ -0,0 +1,88 @@
+import argparse
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import utils
+from adversarial_attack.attack_utils import attack_samples
+from adversarial_attack.dtype_policy import DtypePolicy
+
+
+def run_attack(precision, channels_last, xtest, ytest, args):
+    # the baseline attacks in double precision as well
+    dtype_policy = DtypePolicy('float64', 'float64', 'float64') if precision == 'fp64' else DtypePolicy()
+    net, art_net, fb_net, _ = utils.get_model(dataset=args.dataset, modelname=args.model, norm=args.model_norm,
+                                              precision=precision, channels_last=channels_last)
+    records, runtime_list, _ = attack_samples(art_net, fb_net, net, xtest, ytest, args.epsilon_l1, args.epsilon_l2,
+                                              args.eps_iter, args.attack_norm, args.max_iterations, args.attack_type,
+                                              batchsize=args.batchsize, dtype_policy=dtype_policy)
+    success = np.array([record['success'] for record in records])
+    distance_l1 = np.array([record['distance_l1'] if record['success'] else np.inf for record in records])
+    return success, distance_l1, sum(runtime_list)
+
+
+def compare(baseline, candidate, asr_tolerance, l1_tolerance):
+    '''
+    Attack success rate difference in percentage points and relative difference of the mean L1 distance over the
+    samples both runs attacked successfully.
+    '''
+    (success_ref, l1_ref, _), (success, l1, _) = baseline, candidate
+    asr_diff = 100 * abs(success.mean() - success_ref.mean())
+    both = success & success_ref
+    l1_diff = abs(l1[both].mean() - l1_ref[both].mean()) / l1_ref[both].mean() if both.any() else 0.0
+    return asr_diff, l1_diff, asr_diff <= asr_tolerance and l1_diff <= l1_tolerance
+
+
+def main(args):
+    xtest, ytest = utils.load_dataset(dataset=args.dataset, dataset_split=args.samplesize_accuracy, root=args.dataset_root)
+
+    # samples are selected with the fp64 baseline, all precisions attack the same images
+    net, _, _, _ = utils.get_model(dataset=args.dataset, modelname=args.model, norm=args.model_norm, precision='fp64')
+    correct_map = utils.test_accuracy(net, xtest, ytest)
+    xtest, ytest = utils.subset(correct_map, xtest, ytest, attack_samples=args.samplesize_attack)
+
+    baseline = run_attack('fp64', False, xtest, ytest, args)
+    print(f'{"precision":>16} {"ASR [%]":>8} {"mean L1":>9} {"runtime [s]":>12} {"ASR diff [pp]":>14} {"L1 diff [%]":>12}')
+    print(f'{"fp64":>16} {100 * baseline[0].mean():>8.2f} {baseline[1][baseline[0]].mean():>9.4f} {baseline[2]:>12.2f}')
+
+    passed = True
+    for precision in args.precisions:
+        candidate = run_attack(precision, args.channels_last, xtest, ytest, args)
+        asr_diff, l1_diff, ok = compare(baseline, candidate, args.asr_tolerance, args.l1_tolerance)
+        passed = passed and ok
+        name = precision + (' (NHWC)' if args.channels_last else '')
+        print(f'{name:>16} {100 * candidate[0].mean():>8.2f} {candidate[1][candidate[0]].mean():>9.4f} {candidate[2]:>12.2f} '
+              f'{asr_diff:>14.2f} {100 * l1_diff:>12.2f} {"" if ok else "out of tolerance"}')
+
+    return passed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Checks that reduced precision models keep attack success rate and L1 '
+                                                 'distances within tolerance of the fp64 baseline.')
+    parser.add_argument('--dataset', type=str, default='cifar10', choices=['cifar10', 'imagenet'], help='Dataset to use')
+    parser.add_argument('--samplesize_accuracy', type=int, default=200, help='Split size for test accuracy evaluation')
+    parser.add_argument('--samplesize_attack', type=int, default=50, help='Split size for attack evaluation')
+    parser.add_argument('--dataset_root', type=str, default='../data', help='data folder relative root')
+    parser.add_argument('--model', type=str, default='standard', help='Model name (e.g., standard, MainiAVG, etc.)')
+    parser.add_argument('--model_norm', type=str, default='Linf',
+                        help='Attack Norm the selected model was trained with. Only necessary if you load robustbench models')
+    parser.add_argument('--precisions', type=str, nargs='+', default=['fp32', 'bf16', 'fp16'],
+                        choices=['fp32', 'fp16', 'bf16'], help='Precisions to check against the fp64 baseline')
+    parser.add_argument('--channels_last', action='store_true', help='Run the checked precisions in channels_last layout')
+    parser.add_argument('--attack_type', type=str, default='exp_attack_l1', help='Attack to run')
+    parser.add_argument('--epsilon_l1', type=float, default=12, help='L1 norm epsilon')
+    parser.add_argument('--epsilon_l2', type=float, default=0.5, help='L2 norm epsilon')
+    parser.add_argument('--eps_iter', type=float, default=0.2, help='Step size for manual iterative attacks')
+    parser.add_argument('--attack_norm', type=int, default=1, choices=[1, 2, float('inf')], help='Attack norm type')
+    parser.add_argument('--max_iterations', type=int, default=100, help='Maximum iterations for attacks')
+    parser.add_argument('--batchsize', type=int, default=10, help='Batchsize to run the attack on')
+    parser.add_argument('--asr_tolerance', type=float, default=2.0,
+                        help='Maximum difference of the attack success rate to the baseline in percentage points')
+    parser.add_argument('--l1_tolerance', type=float, default=0.02,
+                        help='Maximum relative difference of the mean L1 distance to the baseline')
+    args = parser.parse_args()
+
+    sys.exit(0 if main(args) else 1)